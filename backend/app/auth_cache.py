@@ -0,0 +1,66 @@
+import hashlib
+import time
+from collections import OrderedDict
+
+from .config import settings
+
+
+def token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class AuthCache:
+    # LRU с TTL: sha256(токена) -> пользователь; попадание не ходит в БД
+    def __init__(self, max_size: int, ttl: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._by_user: dict[int, set[str]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, digest: str) -> dict | None:
+        entry = self._entries.get(digest)
+        if entry is None:
+            self.misses += 1
+            return None
+        deadline, identity = entry
+        if deadline <= time.time():
+            self.invalidate(digest)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(digest)
+        self.hits += 1
+        return identity
+
+    def put(self, digest: str, identity: dict, expires_at: int):
+        self.invalidate(digest)
+        # не дольше ttl и не дольше жизни самой сессии
+        self._entries[digest] = (min(time.time() + self.ttl, expires_at), identity)
+        self._by_user.setdefault(identity["id"], set()).add(digest)
+        while len(self._entries) > self.max_size:
+            old, (_, old_identity) = self._entries.popitem(last=False)
+            self._forget(old, old_identity["id"])
+
+    def invalidate(self, digest: str):
+        entry = self._entries.pop(digest, None)
+        if entry is not None:
+            self._forget(digest, entry[1]["id"])
+
+    def invalidate_user(self, user_id: int, keep: str | None = None):
+        for digest in list(self._by_user.get(user_id, ())):
+            if digest != keep:
+                self.invalidate(digest)
+
+    def _forget(self, digest: str, user_id: int):
+        digests = self._by_user.get(user_id)
+        if digests is not None:
+            digests.discard(digest)
+            if not digests:
+                del self._by_user[user_id]
+
+    def metrics(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+auth_cache = AuthCache(settings.auth_cache_size, settings.auth_cache_ttl_seconds)
@@ -0,0 +1,215 @@
+import asyncio
+import json
+import time
+import uuid
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from . import models, schemas
+from .auth_cache import auth_cache
+from .config import Settings, settings
+from .db import async_engine
+from .membership import membership
+from .profiles import profiles
+from .realtime import hub, notifier
+
+
+MESSAGE_CREATED = "message_created"
+MEMBERSHIP_CHANGED = "membership_changed"
+PROFILE_CHANGED = "profile_changed"
+SESSION_REVOKED = "session_revoked"
+
+
+def message_event(msg) -> dict:
+    data = jsonable_encoder({field: getattr(msg, field) for field in schemas.MessageOut.model_fields})
+    return {"kind": MESSAGE_CREATED, "message": data}
+
+
+def membership_event(chat_id: int, user_id: int, added: bool) -> dict:
+    return {"kind": MEMBERSHIP_CHANGED, "chat_id": chat_id, "user_id": user_id, "added": added}
+
+
+def profile_event(user_id: int) -> dict:
+    return {"kind": PROFILE_CHANGED, "user_id": user_id}
+
+
+def session_event(
+    digest: str | None = None, user_id: int | None = None, keep: str | None = None
+) -> dict:
+    # одна сессия по digest токена или все сессии user_id, кроме keep
+    return {"kind": SESSION_REVOKED, "digest": digest, "user_id": user_id, "keep": keep}
+
+
+def dispatch(event: dict):
+    # применяем событие к состоянию этого процесса — своё или пришедшее от другого воркера
+    kind = event["kind"]
+    if kind == MESSAGE_CREATED:
+        hub.publish_message(event["message"])
+        notifier.notify(event["message"]["chat_id"])
+    elif kind == MEMBERSHIP_CHANGED:
+        if event["added"]:
+            membership.add(event["user_id"], event["chat_id"])
+            hub.subscribe(event["user_id"], event["chat_id"])
+        else:
+            membership.remove(event["user_id"], event["chat_id"])
+            hub.unsubscribe(event["user_id"], event["chat_id"])
+    elif kind == PROFILE_CHANGED:
+        profiles.invalidate(event["user_id"])
+    elif kind == SESSION_REVOKED:
+        if event["digest"] is not None:
+            auth_cache.invalidate(event["digest"])
+            hub.close_session(event["digest"])
+        else:
+            auth_cache.invalidate_user(event["user_id"], keep=event["keep"])
+            hub.close_user_sessions(event["user_id"], keep=event["keep"])
+
+
+class InMemoryBus:
+    # один процесс: событие сразу применяется локально
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, event: dict):
+        dispatch(event)
+
+    async def publish_many(self, events: list[dict]):
+        for event in events:
+            dispatch(event)
+
+    def metrics(self) -> dict:
+        return {"backend": "memory"}
+
+
+class TableBus(InMemoryBus):
+    # Несколько воркеров на одной БД: событие применяется локально и пишется
+    # в bus_events, остальные воркеры забирают его опросом по id > last_id.
+    # Задержка доставки — не больше интервала опроса.
+    # id растут в порядке commit, пока пишет один writer (SQLite); для
+    # PostgreSQL с параллельными вставками нужен LISTEN/NOTIFY-бэкенд.
+    def __init__(self, engine: AsyncEngine, poll_interval: float, retention: int):
+        self.engine = engine
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.origin = uuid.uuid4().hex
+        self.last_id = 0
+        self.published = 0
+        self.received = 0
+        self.errors = 0
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        async with self.engine.connect() as conn:
+            self.last_id = (await conn.execute(select(func.max(models.BusEvent.id)))).scalar() or 0
+        self._task = asyncio.create_task(self._poll_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def publish(self, event: dict):
+        await self.publish_many([event])
+
+    async def publish_many(self, events: list[dict]):
+        # пачка событий — одна транзакция, порядок id совпадает с порядком в списке
+        for event in events:
+            dispatch(event)
+        now = int(time.time())
+        rows = [
+            {
+                "origin": self.origin,
+                "kind": event["kind"],
+                "payload": json.dumps(event, ensure_ascii=False),
+                "created_at": now,
+            }
+            for event in events
+        ]
+        try:
+            async with self.engine.begin() as conn:
+                await conn.execute(insert(models.BusEvent), rows)
+            self.published += len(rows)
+        except Exception as e:
+            # локально событие уже применено, остальные воркеры его не увидят
+            self.errors += 1
+            print("bus: publish failed:", e)
+
+    async def _poll_loop(self):
+        last_cleanup = time.monotonic()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self._poll_once()
+                if time.monotonic() - last_cleanup > self.retention / 10:
+                    await self._cleanup()
+                    last_cleanup = time.monotonic()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                print("bus: poll failed:", e)
+
+    async def _read_after(self, conn, last_id: int):
+        return (
+            await conn.execute(
+                select(models.BusEvent.id, models.BusEvent.origin, models.BusEvent.payload)
+                .where(models.BusEvent.id > last_id)
+                .order_by(models.BusEvent.id)
+            )
+        ).all()
+
+    async def _poll_once(self):
+        async with self.engine.connect() as conn:
+            rows = await self._read_after(conn, self.last_id)
+            if not rows:
+                # id ушли назад — таблицу очистили целиком, и SQLite нумерует
+                # заново; иначе все новые события оказались бы ниже last_id
+                newest = (await conn.execute(select(func.max(models.BusEvent.id)))).scalar() or 0
+                if newest < self.last_id:
+                    print(f"bus: bus_events ids went back from {self.last_id} to {newest}")
+                    self.last_id = 0
+                    rows = await self._read_after(conn, 0)
+        for row in rows:
+            self.last_id = row.id
+            if row.origin == self.origin:
+                continue
+            self.received += 1
+            dispatch(json.loads(row.payload))
+
+    async def _cleanup(self):
+        # последнюю строку не удаляем даже старую: id без AUTOINCREMENT SQLite
+        # берёт как max(id) + 1, и на пустой таблице начал бы снова с 1
+        newest = select(func.max(models.BusEvent.id)).scalar_subquery()
+        async with self.engine.begin() as conn:
+            await conn.execute(
+                delete(models.BusEvent).where(
+                    models.BusEvent.created_at < int(time.time()) - self.retention,
+                    models.BusEvent.id < newest,
+                )
+            )
+
+    def metrics(self) -> dict:
+        return {
+            "backend": "table",
+            "last_id": self.last_id,
+            "published": self.published,
+            "received": self.received,
+            "errors": self.errors,
+        }
+
+
+def make_bus(settings: Settings, engine: AsyncEngine):
+    if settings.bus_backend.lower() == "table":
+        return TableBus(engine, settings.bus_poll_interval_ms / 1000, settings.bus_retention_seconds)
+    return InMemoryBus()
+
+
+bus = make_bus(settings, async_engine)
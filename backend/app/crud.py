@@ -1,94 +1,457 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import desc
-from . import models, schemas
+from sqlalchemy import delete, func, insert, select, text, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, revisions, schemas, search
+from .bus import bus, membership_event, message_event
+from .writer import WriterStopped, writer
 
-def get_user_chats(db: Session, user_id: int):
-    return (
-        db.query(models.Chat)
+async def get_user(db: AsyncSession, user_id: int):
+    return await db.get(models.User, user_id)
+
+async def get_user_by_name(db: AsyncSession, name: str):
+    result = await db.execute(select(models.User).where(models.User.name == name))
+    return result.scalars().first()
+
+async def get_user_chats(db: AsyncSession, user_id: int):
+    result = await db.execute(
+        select(models.Chat)
         .join(models.ChatMember)
-        .filter(models.ChatMember.user_id == user_id)
-        .all()
+        .where(models.ChatMember.user_id == user_id)
     )
+    return result.scalars().all()
 
-def get_chat_messages(db: Session, chat_id: int, limit: int = 50, offset: int = 0):
-    q = (
-        db.query(models.Message, models.User.name.label("user_name"))
-        .join(models.User, models.User.id == models.Message.user_id)
-        .filter(models.Message.chat_id == chat_id)
-        .order_by(models.Message.created_at.desc())
-        .offset(offset)
-        .limit(limit)
+# колонки schemas.MessageOut: страница ленты собирается прямо из строк
+MESSAGE_OUT_COLUMNS = (
+    models.Message.id,
+    models.Message.chat_id,
+    models.Message.user_id,
+    models.Message.text,
+    models.Message.created_at,
+    models.Message.client_id,
+)
+
+async def get_chat_messages(
+    db: AsyncSession,
+    chat_id: int,
+    limit: int = 50,
+    after_id: int | None = None,
+    before_id: int | None = None,
+):
+    # keyset-пагинация по Message.id: after_id — новые сообщения (по возрастанию),
+    # иначе последние limit штук, при before_id — только те, что старше него.
+    # Возвращает строки с колонками MessageOut, без ORM-объектов; имена
+    # отправителей клиент берёт из /users/profiles (кэш profiles.py)
+    q = select(*MESSAGE_OUT_COLUMNS).where(models.Message.chat_id == chat_id)
+    if after_id is not None:
+        q = q.where(models.Message.id > after_id).order_by(models.Message.id.asc())
+    else:
+        if before_id is not None:
+            q = q.where(models.Message.id < before_id)
+        q = q.order_by(models.Message.id.desc())
+    rows = (await db.execute(q.limit(limit))).all()
+
+    # наружу всегда отдаём по возрастанию id
+    if after_id is None:
+        rows.reverse()
+    return rows
+
+async def get_last_message_id(db: AsyncSession, chat_id: int) -> int:
+    # по индексу (chat_id, id) — один переход в конец диапазона
+    result = await db.execute(
+        select(func.max(models.Message.id)).where(models.Message.chat_id == chat_id)
     )
-    rows = q.all()
+    return result.scalar() or 0
 
-    result = []
-    for msg, user_name in rows:
-        # "подкладываем" атрибут, чтобы pydantic мог его прочитать через orm_mode
-        msg.user_name = user_name
-        result.append(msg)
-    return result
+async def get_message_by_client_id(db: AsyncSession, user_id: int, client_id: str):
+    result = await db.execute(
+        select(models.Message).where(
+            models.Message.client_id == client_id, models.Message.user_id == user_id
+        )
+    )
+    return result.scalars().first()
 
-def create_message(db: Session, chat_id: int, user_id: int, text: str):
-    msg = models.Message(chat_id=chat_id, user_id=user_id, text=text)
+async def create_message(
+    db: AsyncSession, chat_id: int, user_id: int, text: str, client_id: str | None = None
+):
+    if writer.running:
+        # write-behind: строка уходит в общий group commit, рассылку делает writer;
+        # соединение сессии на время ожидания возвращаем в пул
+        await db.rollback()
+        try:
+            return await writer.submit(chat_id, user_id, text, client_id)
+        except WriterStopped:
+            # writer остановился, пока шёл rollback — пишем напрямую
+            pass
+    msg = models.Message(chat_id=chat_id, user_id=user_id, text=text, client_id=client_id)
     db.add(msg)
-    db.commit()
-    db.refresh(msg)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # повтор уже принятого сообщения (клиент не дождался ответа) —
+        # отдаём то, что создали в первый раз, и второй раз не рассылаем
+        await db.rollback()
+        if client_id is None:
+            raise
+        existing = await get_message_by_client_id(db, user_id, client_id)
+        if existing is None:
+            raise
+        return existing
+    await db.refresh(msg)
+    await bus.publish(message_event(msg))
     return msg
 
-def create_chat(db: Session, title: str, member_user_ids: list[int]) -> models.Chat:
+async def search_messages(
+    db: AsyncSession,
+    match: str,
+    member_id: int | None = None,
+    limit: int = 20,
+    offset: int = 0,
+    window: int = 200,
+):
+    # Чаты обычно уже отфильтрованы в самом match (см. search.match_query),
+    # member_id — запасной фильтр join-ом по chat_members. Ранжируем по bm25
+    # не все совпадения, а последние window штук: для слова, которое есть
+    # в половине сообщений, полная сортировка — сотни мс. Редкие слова
+    # целиком влезают в окно, для них ранжирование точное. Всё, что старше
+    # окна, идёт следом от новых к старым: порядок зависит только от запроса,
+    # и страницы за окном не перемешивают уже показанные.
+    member_join = (
+        "JOIN chat_members cm ON cm.chat_id = m.chat_id AND cm.user_id = :member_id"
+        if member_id is not None
+        else ""
+    )
+    q = text(
+        f"""
+        SELECT h.id, h.chat_id, h.user_id, u.name AS user_name, h.created_at, h.snippet
+        FROM (
+            -- номер от новых к старым; snippet() в одном запросе с оконной
+            -- функцией SQLite не считает, поэтому отдельным слоем
+            SELECT f.*, row_number() OVER (ORDER BY f.id DESC) AS pos
+            FROM (
+                SELECT m.id, m.chat_id, m.user_id, m.created_at, messages_fts.rank AS rank,
+                       snippet(messages_fts, 0, '<b>', '</b>', '…', 12) AS snippet
+                FROM messages_fts
+                JOIN messages m ON m.id = messages_fts.rowid
+                {member_join}
+                WHERE messages_fts MATCH :match
+                ORDER BY messages_fts.rowid DESC
+                LIMIT :depth
+            ) f
+        ) h
+        JOIN users u ON u.id = h.user_id
+        ORDER BY h.pos > :window, CASE WHEN h.pos <= :window THEN h.rank END, h.id DESC
+        LIMIT :limit OFFSET :offset
+        """
+    ).columns(created_at=models.Message.created_at.type)
+    params = {
+        "match": match,
+        "limit": limit,
+        "offset": offset,
+        "window": window,
+        # совпадений читаем не меньше, чем нужно до конца запрошенной страницы
+        "depth": max(window, offset + limit),
+    }
+    if member_id is not None:
+        params["member_id"] = member_id
+    return (await db.execute(q, params)).all()
+
+async def _accepted_client_ids(db: AsyncSession, rows: list[dict]) -> dict[tuple, int]:
+    # (user_id, client_id) -> id для уже принятых сообщений из rows
+    client_ids = {row["client_id"] for row in rows if row.get("client_id")}
+    if not client_ids:
+        return {}
+    result = await db.execute(
+        select(models.Message.user_id, models.Message.client_id, models.Message.id).where(
+            models.Message.client_id.in_(client_ids)
+        )
+    )
+    return {(user_id, client_id): msg_id for user_id, client_id, msg_id in result.all()}
+
+async def create_messages(db: AsyncSession, rows: list[dict]) -> list[int]:
+    # пачка сообщений (в т.ч. в разные чаты) — одна транзакция, один INSERT
+    # на все строки; id возвращаются в порядке rows. Строки с уже принятым
+    # (user_id, client_id) не вставляются: за них возвращается прежний id.
+    # Две одинаковые пачки одновременно разнимает уникальный индекс —
+    # проигравшая повторяет всё заново и находит сообщения победившей.
+    stmt = insert(models.Message).returning(
+        models.Message.id, models.Message.created_at, sort_by_parameter_order=True
+    )
+    for attempt in range(2):
+        accepted = await _accepted_client_ids(db, rows)
+        fresh = []
+        for row in rows:
+            key = (row["user_id"], row.get("client_id"))
+            if key[1] is None or key not in accepted:
+                fresh.append(row)
+                if key[1] is not None:
+                    # тот же client_id дважды в одной пачке — одно сообщение
+                    accepted[key] = None
+        try:
+            created = (await db.execute(stmt, fresh)).all() if fresh else []
+            await db.commit()
+            break
+        except IntegrityError:
+            await db.rollback()
+            if attempt:
+                raise
+
+    messages = [
+        models.Message(id=msg_id, created_at=created_at, **row)
+        for row, (msg_id, created_at) in zip(fresh, created)
+    ]
+    await bus.publish_many([message_event(msg) for msg in messages])
+
+    new_ids = iter(msg.id for msg in messages)
+    ids = []
+    for row in rows:
+        key = (row["user_id"], row.get("client_id"))
+        if key[1] is None:
+            ids.append(next(new_ids))
+        elif accepted[key] is None:
+            accepted[key] = next(new_ids)
+            ids.append(accepted[key])
+        else:
+            ids.append(accepted[key])
+    return ids
+
+async def create_chat(db: AsyncSession, title: str, member_user_ids: list[int]) -> models.Chat:
     chat = models.Chat(title=title, is_group=True)
     db.add(chat)
-    db.commit()
-    db.refresh(chat)
+    await db.commit()
+    await db.refresh(chat)
 
     for uid in member_user_ids:
         db.add(models.ChatMember(chat_id=chat.id, user_id=uid))
-    db.commit()
+    await revisions.bump(
+        db,
+        revisions.chat_members(chat.id),
+        *(revisions.user_chats(uid) for uid in member_user_ids),
+    )
+    await db.commit()
+
+    for uid in member_user_ids:
+        await bus.publish(membership_event(chat.id, uid, added=True))
 
     return chat
 
-def get_chats_for_user(db: Session, user_id: int):
-    return (
-        db.query(models.Chat)
+async def get_chats_for_user(db: AsyncSession, user_id: int):
+    # строки (id, title, is_group)
+    result = await db.execute(
+        select(models.Chat.id, models.Chat.title, models.Chat.is_group)
         .join(models.ChatMember, models.ChatMember.chat_id == models.Chat.id)
-        .filter(models.ChatMember.user_id == user_id)
-        .all()
+        .where(models.ChatMember.user_id == user_id)
     )
+    return result.all()
 
-def add_user_to_chat(db: Session, chat_id: int, user_id: int):
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if not user:
-        return None
+async def get_chat_summaries(db: AsyncSession, user_id: int):
+    # список чатов одним запросом: последнее сообщение, непрочитанные, участники;
+    # сначала чаты с самыми свежими сообщениями
+    Member = models.ChatMember
+    Msg = models.Message
+    last = aliased(models.Message)
+    others = aliased(models.ChatMember)
 
-    exists = (
-        db.query(models.ChatMember)
-        .filter(
+    last_id = (
+        select(func.max(Msg.id)).where(Msg.chat_id == Member.chat_id).scalar_subquery()
+    )
+    unread = (
+        select(func.count())
+        .where(
+            Msg.chat_id == Member.chat_id,
+            Msg.id > Member.last_read_message_id,
+            Msg.user_id != user_id,
+        )
+        .scalar_subquery()
+    )
+    member_count = (
+        select(func.count()).where(others.chat_id == Member.chat_id).scalar_subquery()
+    )
+
+    q = (
+        select(
+            models.Chat.id,
+            models.Chat.title,
+            Member.last_read_message_id,
+            unread.label("unread_count"),
+            member_count.label("member_count"),
+            last.id.label("last_message_id"),
+            last.user_id.label("last_user_id"),
+            last.text.label("last_text"),
+            last.created_at.label("last_created_at"),
+            models.User.name.label("last_user_name"),
+        )
+        .select_from(Member)
+        .join(models.Chat, models.Chat.id == Member.chat_id)
+        .outerjoin(last, last.id == last_id)
+        .outerjoin(models.User, models.User.id == last.user_id)
+        .where(Member.user_id == user_id)
+        .order_by(func.coalesce(last.id, 0).desc(), models.Chat.id.desc())
+    )
+    return (await db.execute(q)).all()
+
+async def mark_chat_read(db: AsyncSession, chat_id: int, user_id: int, message_id: int):
+    # курсор только двигается вперёд и не дальше последнего сообщения:
+    # иначе будущие сообщения чата сразу считались бы прочитанными
+    message_id = min(message_id, await get_last_message_id(db, chat_id))
+    await db.execute(
+        update(models.ChatMember)
+        .where(
             models.ChatMember.chat_id == chat_id,
             models.ChatMember.user_id == user_id,
+            models.ChatMember.last_read_message_id < message_id,
         )
-        .first()
+        .values(last_read_message_id=message_id)
     )
+    await db.commit()
+
+async def get_chat_member(db: AsyncSession, chat_id: int, user_id: int):
+    return await db.get(models.ChatMember, (chat_id, user_id))
+
+async def add_user_to_chat(db: AsyncSession, chat_id: int, user_id: int):
+    user = await get_user(db, user_id)
+    if not user:
+        return None
+
+    exists = await get_chat_member(db, chat_id, user_id)
     if exists:
         return exists
 
     member = models.ChatMember(chat_id=chat_id, user_id=user_id)
     db.add(member)
-    db.commit()
-    db.refresh(member)
+    await revisions.bump(db, revisions.chat_members(chat_id), revisions.user_chats(user_id))
+    await db.commit()
+    await bus.publish(membership_event(chat_id, user_id, added=True))
     return member
 
-def get_chat_members(db: Session, chat_id: int):
+async def remove_chat_member(db: AsyncSession, chat_id: int, user_id: int) -> bool:
+    member = await get_chat_member(db, chat_id, user_id)
+    if not member:
+        return False
+
+    await db.delete(member)
+    await revisions.bump(db, revisions.chat_members(chat_id), revisions.user_chats(user_id))
+    await db.commit()
+    await bus.publish(membership_event(chat_id, user_id, added=False))
+    return True
+
+async def get_chat_members(db: AsyncSession, chat_id: int):
+    # строки (chat_id, user_id, user_name) — как schemas.ChatMemberOut
     q = (
-        db.query(models.ChatMember, models.User.name.label("user_name"))
+        select(
+            models.ChatMember.chat_id,
+            models.ChatMember.user_id,
+            models.User.name.label("user_name"),
+        )
         .join(models.User, models.User.id == models.ChatMember.user_id)
-        .filter(models.ChatMember.chat_id == chat_id)
+        .where(models.ChatMember.chat_id == chat_id)
     )
-    rows = q.all()
-    result = []
-    for m, user_name in rows:
-        m.user_name = user_name
-        result.append(m)
-    return result
+    return (await db.execute(q)).all()
+
+async def get_users_version(db: AsyncSession) -> tuple[int, int]:
+    # пользователей создают вне API, а id и name в списке не меняются —
+    # список другой, только если изменились число или максимальный id
+    result = await db.execute(select(func.count(), func.max(models.User.id)))
+    count, max_id = result.one()
+    return count, max_id or 0
+
+async def get_all_users(db: AsyncSession):
+    # строки (id, name) — как schemas.UserOut; хеш пароля и прочее не читаем.
+    # Без order_by SQLite отдаёт их в порядке покрывающего индекса по name
+    result = await db.execute(
+        select(models.User.id, models.User.name).order_by(models.User.id)
+    )
+    return result.all()
+
+async def search_users(
+    db: AsyncSession,
+    q: str,
+    limit: int = 20,
+    after_id: int = 0,
+    exclude_chat_id: int | None = None,
+):
+    # справочник: строки (id, name, display_name) по возрастанию id после
+    # after_id. Пустой q — все подряд; exclude_chat_id — кроме участников чата
+    # (проверка по PK chat_members на каждого кандидата)
+    member = models.ChatMember
+    params = {"after_id": after_id, "limit": limit}
+    exclude = ""
+    if exclude_chat_id is not None:
+        params["chat_id"] = exclude_chat_id
+        exclude = (
+            "AND NOT EXISTS (SELECT 1 FROM chat_members cm "
+            "WHERE cm.chat_id = :chat_id AND cm.user_id = u.id)"
+        )
 
-def get_all_users(db: Session):
-    return db.query(models.User).all()
+    if q.strip() and db.bind.dialect.name == "sqlite":
+        # FTS отдаёт совпадения в порядке rowid, так что LIMIT останавливает
+        # перебор, не собирая все совпадения с короткой приставкой
+        match = search.users_match_query(q)
+        if match is None:
+            return []
+        params["match"] = match
+        stmt = text(
+            f"""
+            SELECT u.id, u.name, u.display_name
+            FROM {search.USERS_FTS_TABLE}
+            JOIN users u ON u.id = {search.USERS_FTS_TABLE}.rowid
+            WHERE {search.USERS_FTS_TABLE} MATCH :match
+              AND {search.USERS_FTS_TABLE}.rowid > :after_id
+            {exclude}
+            ORDER BY {search.USERS_FTS_TABLE}.rowid
+            LIMIT :limit
+            """
+        )
+        return (await db.execute(stmt, params)).all()
+
+    stmt = (
+        select(models.User.id, models.User.name, models.User.display_name)
+        .where(models.User.id > after_id)
+        .order_by(models.User.id)
+        .limit(limit)
+    )
+    if q.strip():
+        # без FTS (не SQLite) — префикс первого слова по LIKE, без индекса
+        prefix = q.strip().split()[0].lower().replace("%", "").replace("_", "") + "%"
+        stmt = stmt.where(
+            (func.lower(models.User.name).like(prefix))
+            | (func.lower(models.User.display_name).like(prefix))
+        )
+    if exclude_chat_id is not None:
+        stmt = stmt.where(
+            ~select(member.user_id)
+            .where(member.chat_id == exclude_chat_id, member.user_id == models.User.id)
+            .exists()
+        )
+    return (await db.execute(stmt)).all()
+
+async def create_session(db: AsyncSession, user_id: int, token_hash: str, expires_at: int):
+    db.add(models.AuthSession(token_hash=token_hash, user_id=user_id, expires_at=expires_at))
+    await db.commit()
+
+async def get_session_user(db: AsyncSession, token_hash: str):
+    result = await db.execute(
+        select(models.AuthSession.expires_at, models.User.id, models.User.name)
+        .join(models.User, models.User.id == models.AuthSession.user_id)
+        .where(models.AuthSession.token_hash == token_hash)
+    )
+    return result.first()
+
+async def delete_session(db: AsyncSession, token_hash: str):
+    await db.execute(delete(models.AuthSession).where(models.AuthSession.token_hash == token_hash))
+    await db.commit()
+
+async def delete_user_sessions(db: AsyncSession, user_id: int, keep: str | None = None):
+    q = delete(models.AuthSession).where(models.AuthSession.user_id == user_id)
+    if keep is not None:
+        q = q.where(models.AuthSession.token_hash != keep)
+    await db.execute(q)
+    await db.commit()
+
+async def delete_expired_sessions(db: AsyncSession, user_id: int, now: int):
+    await db.execute(
+        delete(models.AuthSession).where(
+            models.AuthSession.user_id == user_id,
+            models.AuthSession.expires_at <= now,
+        )
+    )
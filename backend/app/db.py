@@ -1,13 +1,92 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./ripplechat.db"
+from .config import Settings, settings
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+SQLALCHEMY_DATABASE_URL = settings.database_url
+
+
+def install_sqlite_pragmas(engine: Engine, settings: Settings):
+    pragmas = settings.sqlite_pragmas()
+    if not pragmas:
+        return
+
+    # pragma действуют на соединение, поэтому ставим их на каждое новое
+    @event.listens_for(engine, "connect")
+    def _apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+
+def engine_options(settings: Settings) -> dict:
+    options: dict = {}
+    if settings.is_sqlite:
+        options["connect_args"] = {"check_same_thread": False}
+    if settings.is_sqlite_memory:
+        # у in-memory базы свой пул на одно соединение, параметры пула ей не нужны
+        return options
+    options.update(
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle,
+        pool_pre_ping=settings.db_pool_pre_ping,
+    )
+    return options
+
+
+def make_engine(settings: Settings) -> Engine:
+    engine = create_engine(settings.database_url, **engine_options(settings))
+    if settings.is_sqlite:
+        install_sqlite_pragmas(engine, settings)
+    return engine
+
+
+# драйверы, которыми подменяем синхронный, если async URL не задан явно
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+ASYNC_CAPABLE = {"aiosqlite", "asyncpg", "psycopg", "aiomysql", "asyncmy"}
+
+
+def async_database_url(settings: Settings) -> str:
+    if settings.async_database_url:
+        return settings.async_database_url
+    scheme, sep, rest = settings.database_url.partition("://")
+    dialect, _, driver = scheme.partition("+")
+    if driver in ASYNC_CAPABLE:
+        return settings.database_url
+    if dialect not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver known for {scheme!r}, set RIPPLECHAT_ASYNC_DATABASE_URL")
+    return ASYNC_DRIVERS[dialect] + sep + rest
+
+
+def make_async_engine(settings: Settings) -> AsyncEngine:
+    options = engine_options(settings)
+    options.pop("connect_args", None)  # aiosqlite сам держит соединение в своём потоке
+    engine = create_async_engine(async_database_url(settings), **options)
+    if settings.is_sqlite:
+        install_sqlite_pragmas(engine.sync_engine, settings)
+    return engine
+
+
+# синхронный движок — для миграций и скриптов, эндпоинты работают через async_engine
+engine = make_engine(settings)
+async_engine = make_async_engine(settings)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False: после commit атрибуты читаются без ленивой загрузки,
+# которая в async-сессии невозможна
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
 
 Base = declarative_base()
 
@@ -18,3 +97,8 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -1,27 +1,38 @@
+import asyncio
+from contextlib import asynccontextmanager
 from typing import List
 
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Request, status, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, Response
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
+import orjson
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from .db import Base, engine, get_db
-from . import models, schemas, crud
+from .db import Base, engine, get_async_db
+from . import models, schemas, crud, search, revisions
 
 
-from .security import hash_password
+from .security import PasswordPoolBusy, password_pool
+from .membership import membership
+from .auth_cache import auth_cache, token_digest
+from .sessions import issue_token, resolve_token, revoke_token, revoke_user_tokens
 
-from .db import SessionLocal
-
-from .security import verify_password
+from .db import AsyncSessionLocal, async_engine
 
 from typing import cast
 from .models import User
+from .realtime import hub, notifier
+from .bus import bus, profile_event
+from .profiles import profiles
+from .writer import writer
+from .config import settings
+from .migrations import run_migrations
+from .compression import CompressionMiddleware
 
 
 
-# # создаём все таблицы один раз при импорте приложения
-# Base.metadata.create_all(bind=engine)
+# таблицы и индексы создаёт run_migrations() при старте приложения
 
 
 # def init_test_users():
@@ -49,7 +60,41 @@ from .models import User
 
 
 
-app = FastAPI(title="RippleChat API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    run_migrations(engine)
+    # хабу нужен loop, чтобы синхронные эндпоинты могли слать в websocket
+    hub.bind_loop(asyncio.get_running_loop())
+    await bus.start()
+    if settings.write_behind:
+        await writer.start()
+    yield
+    # сначала дописываем очередь сообщений — ей ещё нужны шина и движок
+    await writer.stop()
+    await bus.stop()
+    password_pool.shutdown()
+    await async_engine.dispose()
+
+
+app = FastAPI(title="RippleChat API", lifespan=lifespan)
+
+if settings.compression:
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=settings.compression_min_bytes,
+        gzip_level=settings.compression_gzip_level,
+        brotli_quality=settings.compression_brotli_quality,
+    )
+
+
+@app.exception_handler(PasswordPoolBusy)
+async def password_pool_busy_handler(request: Request, exc: PasswordPoolBusy):
+    # очередь на хеширование переполнена — пусть клиент повторит чуть позже
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Server is busy, try again"},
+        headers={"Retry-After": "1"},
+    )
 
 # =======================
 # Простая OAuth2-схема
@@ -70,10 +115,10 @@ USERS = {
 @app.post("/login", response_model=schemas.Token)
 async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     # ищем пользователя в БД по логину (name)
-    user = db.query(models.User).filter(models.User.name == form_data.username).first()
+    user = await crud.get_user_by_name(db, form_data.username)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -81,14 +126,14 @@ async def login(
         )
 
     stored_hash = str(user.hashed_password)
-    if not verify_password(form_data.password, stored_hash):
+    if not await password_pool.verify(form_data.password, stored_hash):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Incorrect username or password",
         )
 
-    # упрощённо: токен = логин, как раньше
-    token = user.name
+    # непрозрачный случайный токен, в БД лежит только его хеш
+    token = await issue_token(db, user.id)
 
     return {
         "access_token": token,
@@ -98,18 +143,38 @@ async def login(
 
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    # token == name (логин пользователя)
-    user = db.query(models.User).filter(models.User.name == token).first()
-    if not user:
+    # обычно отвечает кеш в памяти, в БД идём только при промахе
+    identity = await resolve_token(db, token)
+    if identity is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid token",
             headers={"WWW-Authenticate": "Bearer"},
         )
     # возвращаем такой же словарь, как раньше USERS[token]
-    return {"id": user.id, "password": "", "name": user.name}
+    return identity
+
+
+async def require_chat_member(
+    chat_id: int,
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    # проверка по индексу в памяти, БД трогаем только при первой загрузке пользователя
+    if not await membership.is_member(db, current_user["id"], chat_id):
+        raise HTTPException(status_code=403, detail="Not a member of this chat")
+    return current_user
+
+
+@app.post("/logout")
+async def logout(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db),
+):
+    await revoke_token(db, token)
+    return {"ok": True}
 
 # =======================
 # Инициализация БД
@@ -137,6 +202,57 @@ async def get_current_user(
 
 
 
+# =======================
+# Условные запросы (ETag)
+# =======================
+
+# Версию списка узнаём одним запросом по ключу — до выборки данных: если
+# данные поменяются между ними, клиент получит новые данные со старым
+# тегом и просто перезапросит их в следующий раз. Совпал If-None-Match —
+# отвечаем 304 без выборки и сериализации.
+CONDITIONAL_HEADERS = {"Cache-Control": "private, no-cache"}
+
+
+def make_etag(*parts) -> str:
+    # слабый: тело может прийти сжатым, но данные те же
+    return 'W/"' + ".".join(str(part) for part in parts) + '"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in header.split(","))
+
+
+def not_modified(request: Request, response: Response, etag: str) -> Response | None:
+    headers = {"ETag": etag, **CONDITIONAL_HEADERS}
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+    return None
+
+
+def row_dicts(rows) -> list[dict]:
+    # Row._asdict() на строку в разы дороже, чем zip по общему списку колонок
+    if not rows:
+        return []
+    keys = rows[0]._fields
+    return [dict(zip(keys, row)) for row in rows]
+
+
+def json_response(content, response: Response) -> Response:
+    # быстрый путь для списков: content собран из строк БД и уже состоит из
+    # JSON-типов, поэтому проверку по response_model пропускаем, а байты
+    # собирает orjson. response_model у эндпоинта остаётся для схемы OpenAPI
+    return Response(
+        orjson.dumps(content), media_type="application/json", headers=dict(response.headers)
+    )
+
+
 # =======================
 # Эндпоинты
 # =======================
@@ -144,101 +260,322 @@ async def get_current_user(
 @app.get("/users/{user_id}/chats")
 async def get_user_chats(
     user_id: int,
+    request: Request,
+    response: Response,
     current_user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     if current_user["id"] != user_id:
         raise HTTPException(status_code=403, detail="Forbidden")
 
-    chats = (
-        db.query(models.Chat)
-        .join(models.ChatMember, models.ChatMember.chat_id == models.Chat.id)
-        .filter(models.ChatMember.user_id == user_id)
-        .all()
-    )
+    revision = await revisions.get(db, revisions.user_chats(user_id))
+    cached = not_modified(request, response, make_etag("uc", user_id, revision))
+    if cached is not None:
+        return cached
 
-    return chats
+    chats = await crud.get_chats_for_user(db, user_id)
+    return json_response(row_dicts(chats), response)
 
 
+# список чатов для экрана: превью, непрочитанные и участники одним запросом
+@app.get("/users/{user_id}/chats/summary", response_model=list[schemas.ChatSummaryOut])
+async def get_user_chat_summaries(
+    user_id: int,
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    if current_user["id"] != user_id:
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+    rows = await crud.get_chat_summaries(db, user_id)
+    return [
+        schemas.ChatSummaryOut(
+            id=r.id,
+            title=r.title,
+            member_count=r.member_count,
+            unread_count=r.unread_count,
+            last_read_message_id=r.last_read_message_id,
+            last_message=(
+                schemas.LastMessageOut(
+                    id=r.last_message_id,
+                    user_id=r.last_user_id,
+                    # автора могло не остаться в users: SQLite не проверяет
+                    # внешний ключ, а без имени упал бы весь список чатов
+                    user_name=r.last_user_name or f"User {r.last_user_id}",
+                    text=r.last_text,
+                    created_at=r.last_created_at,
+                )
+                if r.last_message_id is not None
+                else None
+            ),
+        )
+        for r in rows
+    ]
+
+
+@app.post("/chats/{chat_id}/read")
+async def mark_chat_read(
+    chat_id: int,
+    payload: schemas.ChatReadUpdate,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(require_chat_member),
+):
+    await crud.mark_chat_read(db, chat_id, current_user["id"], payload.message_id)
+    return {"ok": True}
 
-@app.get("/chats/{chat_id}/messages", response_model=list[schemas.MessageOut])
+
+
+MESSAGES_PAGE_MAX = 200
+LONG_POLL_MAX = 30  # секунды
+
+
+@app.get("/chats/{chat_id}/messages", response_model=schemas.MessagePage)
 async def read_chat_messages(
     chat_id: int,
+    request: Request,
+    response: Response,
     limit: int = 50,
-    offset: int = 0,
-    db: Session = Depends(get_db),
-    current_user: dict = Depends(get_current_user),
+    after_id: int | None = None,
+    before_id: int | None = None,
+    wait: float = 0,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(require_chat_member),
 ):
-    msgs = crud.get_chat_messages(db, chat_id=chat_id, limit=limit, offset=offset)
-    return list(reversed(msgs))
+    if after_id is not None and before_id is not None:
+        raise HTTPException(status_code=400, detail="Use either after_id or before_id")
+    if wait and after_id is None:
+        raise HTTPException(status_code=400, detail="wait requires after_id")
+    limit = max(1, min(limit, MESSAGES_PAGE_MAX))
+    wait = max(0.0, min(wait, LONG_POLL_MAX))
+
+    if not wait:
+        # сообщения только добавляются: пока в чате нет новых, любая
+        # страница та же. Long-poll ждёт именно изменений — ему ETag не нужен
+        last_id = await crud.get_last_message_id(db, chat_id)
+        cached = not_modified(request, response, make_etag("m", chat_id, last_id))
+        if cached is not None:
+            return cached
+
+    ev = notifier.event(chat_id) if wait else None
+    try:
+        msgs = await crud.get_chat_messages(
+            db, chat_id=chat_id, limit=limit, after_id=after_id, before_id=before_id
+        )
+
+        # long-poll: новых нет — держим запрос, пока crud.create_message не разбудит
+        if not msgs and ev is not None:
+            # отдаём соединение в пул, пока ждём
+            await db.rollback()
+            if await notifier.wait(ev, wait):
+                msgs = await crud.get_chat_messages(
+                    db, chat_id=chat_id, limit=limit, after_id=after_id
+                )
+    finally:
+        if ev is not None:
+            notifier.release(chat_id)
+
+    # полная страница — значит, в эту сторону могут быть ещё сообщения
+    next_cursor = None
+    if len(msgs) == limit:
+        next_cursor = msgs[-1].id if after_id is not None else msgs[0].id
+
+    return json_response(
+        {"items": row_dicts(msgs), "next_cursor": next_cursor}, response
+    )
 
 
 
 @app.post("/chats/{chat_id}/messages", response_model=schemas.MessageOut)
-def send_message(
+async def send_message(
     chat_id: int,
     payload: schemas.MessageCreate,
-    db: Session = Depends(get_db),
-    current_user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(require_chat_member),
 ):
-    msg = crud.create_message(
-        db, chat_id=chat_id, user_id=payload.user_id, text=payload.text
+    # писать можно только от своего имени: user_id входит и в ключ повтора
+    if payload.user_id != current_user["id"]:
+        raise HTTPException(status_code=403, detail="Cannot send messages as another user")
+    msg = await crud.create_message(
+        db,
+        chat_id=chat_id,
+        user_id=payload.user_id,
+        text=payload.text,
+        client_id=payload.client_id,
     )
     return msg
 
 
+MESSAGES_BULK_MAX = 1000
+
+
+# пачка сообщений для ботов и импорта: одна авторизация, одна транзакция
+@app.post("/messages/bulk", response_model=schemas.MessageBulkOut)
+async def send_messages_bulk(
+    payload: list[schemas.MessageBulkItem],
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_current_user),
+):
+    if not payload:
+        return {"ids": []}
+    if len(payload) > MESSAGES_BULK_MAX:
+        raise HTTPException(
+            status_code=413, detail=f"At most {MESSAGES_BULK_MAX} messages per request"
+        )
+
+    # как и в одиночной отправке: только от своего имени и только в свои чаты
+    if any(item.user_id != current_user["id"] for item in payload):
+        raise HTTPException(status_code=403, detail="Cannot send messages as another user")
+    chat_ids = sorted({item.chat_id for item in payload})
+    denied = [
+        chat_id for chat_id in chat_ids
+        if not await membership.is_member(db, current_user["id"], chat_id)
+    ]
+    if denied:
+        raise HTTPException(status_code=403, detail=f"Not a member of chats: {denied}")
+
+    ids = await crud.create_messages(
+        db,
+        [
+            {
+                "chat_id": item.chat_id,
+                "user_id": item.user_id,
+                "text": item.text,
+                "client_id": item.client_id,
+            }
+            for item in payload
+        ],
+    )
+    return {"ids": ids}
+
+
+SEARCH_PAGE_MAX = 50
+
+
+# полнотекстовый поиск по сообщениям в чатах пользователя (или в одном чате)
+@app.get("/search/messages", response_model=schemas.SearchPage)
+async def search_messages(
+    q: str,
+    chat_id: int | None = None,
+    limit: int = 20,
+    cursor: int = 0,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_current_user),
+):
+    if not settings.is_sqlite:
+        raise HTTPException(status_code=501, detail="Search is not available on this database")
+    if chat_id is not None:
+        if not await membership.is_member(db, current_user["id"], chat_id):
+            raise HTTPException(status_code=403, detail="Not a member of this chat")
+        chat_ids = [chat_id]
+    else:
+        chat_ids = sorted(await membership.chat_ids(db, current_user["id"]))
+    # фильтр по чатам — прямо в MATCH; если чатов слишком много — join-ом в БД
+    scoped = len(chat_ids) <= search.MAX_CHAT_TERMS
+    match = search.match_query(q, chat_ids if scoped else None)
+    if match is None or not chat_ids:
+        return {"items": [], "next_cursor": None}
+
+    # выдача ранжирована, поэтому курсор — смещение в ней
+    limit = max(1, min(limit, SEARCH_PAGE_MAX))
+    cursor = max(0, cursor)
+    rows = await crud.search_messages(
+        db,
+        match,
+        member_id=None if scoped else current_user["id"],
+        limit=limit + 1,
+        offset=cursor,
+    )
+    next_cursor = cursor + limit if len(rows) > limit else None
+    return {"items": [row._mapping for row in rows[:limit]], "next_cursor": next_cursor}
+
+
 @app.post("/chats", response_model=schemas.ChatOut)
-def create_chat_endpoint(
+async def create_chat_endpoint(
     payload: schemas.ChatCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user),
 ):
     member_ids = [payload.creator_id]
-    chat = crud.create_chat(db, title=payload.title, member_user_ids=member_ids)
+    chat = await crud.create_chat(db, title=payload.title, member_user_ids=member_ids)
     return chat
 
 
 # список всех пользователей
 @app.get("/users", response_model=list[schemas.UserOut])
-def list_users(
-    db: Session = Depends(get_db),
+async def list_users(
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user),
 ):
-    users = crud.get_all_users(db)
-    return users
+    count, max_id = await crud.get_users_version(db)
+    cached = not_modified(request, response, make_etag("u", count, max_id))
+    if cached is not None:
+        return cached
+
+    users = await crud.get_all_users(db)
+    return json_response(row_dicts(users), response)
+
+
+USER_SEARCH_PAGE_MAX = 50
+
+
+# справочник для добавления в чат: поиск по name и display_name по мере
+# набора; объявлен раньше /users/{user_id}, иначе "search" попадёт туда
+@app.get("/users/search", response_model=schemas.UserSearchPage)
+async def search_users(
+    response: Response,
+    q: str = "",
+    limit: int = 20,
+    cursor: int = 0,
+    exclude_chat_id: int | None = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_current_user),
+):
+    # состав чужого чата не раскрываем
+    if exclude_chat_id is not None and not await membership.is_member(
+        db, current_user["id"], exclude_chat_id
+    ):
+        raise HTTPException(status_code=403, detail="Not a member of this chat")
+    limit = max(1, min(limit, USER_SEARCH_PAGE_MAX))
+    rows = await crud.search_users(
+        db, q, limit=limit + 1, after_id=max(0, cursor), exclude_chat_id=exclude_chat_id
+    )
+    next_cursor = rows[limit - 1].id if len(rows) > limit else None
+    return json_response({"items": row_dicts(rows[:limit]), "next_cursor": next_cursor}, response)
 
 
 # участники чата
 @app.get("/chats/{chat_id}/members", response_model=list[schemas.ChatMemberOut])
-def list_chat_members(
+async def list_chat_members(
     chat_id: int,
-    db: Session = Depends(get_db),
-    current_user: dict = Depends(get_current_user),
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(require_chat_member),
 ):
-    members = crud.get_chat_members(db, chat_id)
-    return [
-        schemas.ChatMemberOut(
-            chat_id=m.chat_id,
-            user_id=m.user_id,
-            user_name=m.user_name,
-        )
-        for m in members
-    ]
+    revision = await revisions.get(db, revisions.chat_members(chat_id))
+    cached = not_modified(request, response, make_etag("cm", chat_id, revision))
+    if cached is not None:
+        return cached
+
+    members = await crud.get_chat_members(db, chat_id)
+    return json_response(row_dicts(members), response)
 
 
 # добавление участника
 @app.post("/chats/{chat_id}/members", response_model=schemas.ChatMemberOut)
-def add_chat_member(
+async def add_chat_member(
     chat_id: int,
     payload: schemas.ChatMemberAdd,
-    db: Session = Depends(get_db),
-    current_user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(require_chat_member),
 ):
-    member = crud.add_user_to_chat(db, chat_id, payload.user_id)
+    member = await crud.add_user_to_chat(db, chat_id, payload.user_id)
     if member is None:
         raise HTTPException(status_code=404, detail="User not found")
 
-    user = db.query(models.User).filter(models.User.id == payload.user_id).first()
+    user = await crud.get_user(db, payload.user_id)
     if user is None:
         # теоретически сюда не попадём, но для тайпчекера и надёжности
         raise HTTPException(status_code=404, detail="User not found")
@@ -252,56 +589,93 @@ def add_chat_member(
     )
 
 @app.delete("/chats/{chat_id}/members/{user_id}")
-def remove_chat_member(chat_id: int, user_id: int, db: Session = Depends(get_db)):
-    # ищем запись участника
-    member = (
-        db.query(models.ChatMember)
-        .filter(
-            models.ChatMember.chat_id == chat_id,
-            models.ChatMember.user_id == user_id,
-        )
-        .first()
-    )
-    if not member:
+async def remove_chat_member(
+    chat_id: int,
+    user_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(require_chat_member),
+):
+    if not await crud.remove_chat_member(db, chat_id, user_id):
         raise HTTPException(status_code=404, detail="Member not found in this chat")
 
-    db.delete(member)
-    db.commit()
     return {"ok": True}
 
-@app.get("/users/{user_id}")
-def get_user(user_id: int, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+def profile_out(profile: dict) -> dict:
+    # как и раньше в GET /users/{user_id}: без ника — логин
     return {
-        "id": user.id,
-        "name": user.name,
-        "display_name": user.display_name or user.name,
+        "id": profile["id"],
+        "name": profile["name"],
+        "display_name": profile["display_name"] or profile["name"],
     }
 
+
+PROFILES_MAX = 200
+
+
+# имена отправителей одним запросом: /users/profiles?ids=1,2,3;
+# объявлен раньше /users/{user_id}. Неизвестные id в ответ не попадают
+@app.get("/users/profiles", response_model=list[schemas.UserProfileOut])
+async def get_user_profiles(
+    ids: str,
+    response: Response,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_current_user),
+):
+    try:
+        user_ids = list(dict.fromkeys(int(part) for part in ids.split(",") if part.strip()))
+    except ValueError:
+        raise HTTPException(status_code=422, detail="ids must be comma-separated integers")
+    if len(user_ids) > PROFILES_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {PROFILES_MAX} ids per request")
+
+    found = await profiles.get_many(db, user_ids)
+    return json_response(
+        [profile_out(found[user_id]) for user_id in user_ids if user_id in found], response
+    )
+
+
+@app.get("/users/{user_id}")
+async def get_user(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    profile = await profiles.get(db, user_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return profile_out(profile)
+
 @app.put("/users/{user_id}")
-def update_user_profile(
+async def update_user_profile(
     user_id: int,
     payload: schemas.UserProfileUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_current_user),
 ):
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+    # менять ник и пароль можно только себе: смена пароля ещё и гасит сессии
+    if current_user["id"] != user_id:
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+    user = await crud.get_user(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
     user = cast(User, user)  # подсказываем типизатору, что это экземпляр, а не Column
 
 
-    if payload.display_name is not None and payload.display_name != "":
+    name_changed = payload.display_name is not None and payload.display_name != ""
+    if name_changed:
         user.display_name = payload.display_name  # type: ignore[reportAttributeAccessIssue]
 
-    if payload.password is not None and payload.password != "":
-        user.hashed_password = hash_password(payload.password) # type: ignore[reportAttributeAccessIssue]
+    password_changed = payload.password is not None and payload.password != ""
+    if password_changed:
+        user.hashed_password = await password_pool.hash(payload.password) # type: ignore[reportAttributeAccessIssue]
 
 
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+
+    if name_changed:
+        # сбрасываем кэш профилей — и в этом воркере, и в остальных
+        await bus.publish(profile_event(user_id))
+
+    if password_changed:
+        await revoke_user_tokens(db, user_id)
 
     return {
         "id": user.id,
@@ -312,30 +686,94 @@ def update_user_profile(
 
 
 @app.post("/users/{user_id}/password")
-def change_password(
+async def change_password(
     user_id: int,
     payload: schemas.PasswordChange,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user),
+    token: str = Depends(oauth2_scheme),
 ):
     if current_user["id"] != user_id:
         raise HTTPException(status_code=403, detail="Forbidden")
 
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+    user = await crud.get_user(db, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
     stored_hash = str(user.hashed_password)
-    if not verify_password(payload.old_password, stored_hash):
+    if not await password_pool.verify(payload.old_password, stored_hash):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Incorrect old password",
         )
 
-    user.hashed_password = hash_password(payload.new_password)  # type: ignore[reportAttributeAccessIssue]
+    user.hashed_password = await password_pool.hash(payload.new_password)  # type: ignore[reportAttributeAccessIssue]
 
-    db.commit()
+    await db.commit()
+    # остальные сессии пользователя больше не действуют, текущая остаётся
+    await revoke_user_tokens(db, user_id, keep_token=token)
     return {"ok": True}
 
 
+# =======================
+# WebSocket: push новых сообщений
+# =======================
+
+WS_AUTH_TIMEOUT = 10
+
+
+async def _load_ws_user(token: str):
+    async with AsyncSessionLocal() as db:
+        identity = await resolve_token(db, token)
+        if identity is None:
+            return None, []
+        chat_ids = sorted(await membership.chat_ids(db, identity["id"]))
+        return identity["id"], chat_ids
+
+
+@app.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket):
+    await websocket.accept()
+
+    # первым сообщением клиент присылает {"token": "..."}
+    try:
+        auth = await asyncio.wait_for(websocket.receive_json(), WS_AUTH_TIMEOUT)
+    except (asyncio.TimeoutError, WebSocketDisconnect, ValueError):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    token = auth.get("token") if isinstance(auth, dict) else None
+    user_id, chat_ids = (None, [])
+    if isinstance(token, str) and token:
+        user_id, chat_ids = await _load_ws_user(token)
+    if user_id is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    hub.connect(websocket, user_id, chat_ids, token_digest(token))
+    try:
+        await websocket.send_json({"type": "ready", "user_id": user_id, "chat_ids": chat_ids})
+        while True:
+            # входящие кадры (ping от клиента) просто читаем, чтобы заметить disconnect
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        hub.disconnect(websocket)
+
+
+# =======================
+# Метрики
+# =======================
 
+@app.get("/metrics")
+async def metrics():
+    return {
+        "password_pool": password_pool.metrics(),
+        "auth_cache": auth_cache.metrics(),
+        "membership": membership.metrics(),
+        "long_poll": notifier.metrics(),
+        "bus": bus.metrics(),
+        "writer": writer.metrics(),
+        "profiles": profiles.metrics(),
+    }
@@ -0,0 +1,53 @@
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+
+
+class MembershipIndex:
+    # user_id -> множество chat_id; пользователь подгружается из БД при первом
+    # обращении, дальше индекс поддерживают crud-функции, меняющие состав чатов
+    def __init__(self):
+        self._chats: dict[int, set[int]] = {}
+        # счётчик изменений по пользователю: загрузка, пересекшаяся с изменением,
+        # не должна положить в индекс устаревший снимок
+        self._generation: dict[int, int] = {}
+        self.hits = 0
+        self.loads = 0
+
+    async def chat_ids(self, db: AsyncSession, user_id: int) -> set[int]:
+        chats = self._chats.get(user_id)
+        if chats is not None:
+            self.hits += 1
+            return chats
+
+        generation = self._generation.get(user_id, 0)
+        result = await db.execute(
+            select(models.ChatMember.chat_id).where(models.ChatMember.user_id == user_id)
+        )
+        chats = set(result.scalars().all())
+        self.loads += 1
+        if self._generation.get(user_id, 0) == generation:
+            self._chats[user_id] = chats
+        return chats
+
+    async def is_member(self, db: AsyncSession, user_id: int, chat_id: int) -> bool:
+        return chat_id in await self.chat_ids(db, user_id)
+
+    def add(self, user_id: int, chat_id: int):
+        self._generation[user_id] = self._generation.get(user_id, 0) + 1
+        chats = self._chats.get(user_id)
+        if chats is not None:
+            chats.add(chat_id)
+
+    def remove(self, user_id: int, chat_id: int):
+        self._generation[user_id] = self._generation.get(user_id, 0) + 1
+        chats = self._chats.get(user_id)
+        if chats is not None:
+            chats.discard(chat_id)
+
+    def metrics(self) -> dict:
+        return {"users": len(self._chats), "hits": self.hits, "loads": self.loads}
+
+
+membership = MembershipIndex()
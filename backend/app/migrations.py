@@ -0,0 +1,126 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+from .db import Base, engine
+from . import search
+from . import models  # noqa: F401  регистрирует таблицы в Base.metadata
+
+
+# Каждый шаг выполняется один раз, номер записывается в schema_migrations.
+# Шаги должны быть идемпотентными: на новой базе create_all уже создаёт
+# всё по моделям, и шаг не должен падать на существующих объектах.
+
+
+def add_column(conn: Connection, table: str, column: str, ddl: str) -> bool:
+    # True, если колонку пришлось добавить
+    columns = {c["name"] for c in inspect(conn).get_columns(table)}
+    if column in columns:
+        return False
+    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+    return True
+
+
+def _messages_timeline_index(conn: Connection):
+    conn.execute(
+        text("CREATE INDEX IF NOT EXISTS ix_messages_chat_id_id ON messages (chat_id, id)")
+    )
+    # одиночный индекс по chat_id — префикс составного, больше не нужен
+    conn.execute(text("DROP INDEX IF EXISTS ix_messages_chat_id"))
+
+
+def _chat_members_user_index(conn: Connection):
+    conn.execute(
+        text("CREATE INDEX IF NOT EXISTS ix_chat_members_user_id ON chat_members (user_id)")
+    )
+
+
+def _chat_members_read_cursor(conn: Connection):
+    if not add_column(conn, "chat_members", "last_read_message_id", "INTEGER NOT NULL DEFAULT 0"):
+        return
+    # история до обновления считается прочитанной: иначе вся она стала бы
+    # непрочитанной, и подсчёт в сводке чатов проходил бы её целиком
+    conn.execute(
+        text(
+            "UPDATE chat_members SET last_read_message_id = coalesce("
+            "(SELECT max(id) FROM messages WHERE messages.chat_id = chat_members.chat_id), 0)"
+        )
+    )
+
+
+def _messages_fts(conn: Connection):
+    # FTS5 есть только в SQLite; на остальных СУБД поиск отключён
+    if conn.dialect.name != "sqlite":
+        return
+    search.create_index(conn)
+    # индексируем уже накопленные сообщения; на большой базе это долго —
+    # то же самое делает python -m app.search rebuild
+    search.rebuild(conn)
+
+
+def _messages_client_id(conn: Connection):
+    add_column(conn, "messages", "client_id", "VARCHAR(64)")
+    conn.execute(
+        text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS ux_messages_client_id "
+            "ON messages (client_id, user_id)"
+        )
+    )
+
+
+def _users_fts(conn: Connection):
+    # как и поиск по сообщениям — только SQLite, на остальных СУБД
+    # справочник ищет по LIKE (crud.search_users)
+    if conn.dialect.name != "sqlite":
+        return
+    search.create_users_index(conn)
+    search.rebuild_users(conn)
+
+
+MIGRATIONS = [
+    (1, "messages (chat_id, id) index", _messages_timeline_index),
+    (2, "chat_members (user_id) index", _chat_members_user_index),
+    (3, "chat_members.last_read_message_id", _chat_members_read_cursor),
+    (4, "messages full-text index", _messages_fts),
+    (5, "messages.client_id", _messages_client_id),
+    (6, "users full-text index", _users_fts),
+]
+
+
+# ключ advisory-lock, чтобы несколько воркеров не мигрировали PostgreSQL одновременно
+PG_MIGRATION_LOCK = 0x52504C43
+
+
+def run_migrations(bind: Engine = engine):
+    with bind.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": PG_MIGRATION_LOCK})
+        elif conn.dialect.name == "sqlite":
+            # pysqlite открывает транзакцию только перед DML, и несколько воркеров
+            # успевают одновременно решить, что таблиц нет; берём блокировку записи
+            # сразу, остальные ждут её в пределах busy_timeout
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+        Base.metadata.create_all(bind=conn)
+        conn.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS schema_migrations ("
+                "version INTEGER PRIMARY KEY, name VARCHAR NOT NULL)"
+            )
+        )
+        applied = set(conn.execute(text("SELECT version FROM schema_migrations")).scalars())
+
+        for version, name, step in MIGRATIONS:
+            if version in applied:
+                continue
+            step(conn)
+            conn.execute(
+                text(
+                    "INSERT INTO schema_migrations (version, name) VALUES (:v, :n) "
+                    "ON CONFLICT (version) DO NOTHING"
+                ),
+                {"v": version, "n": name},
+            )
+            print(f"== migration {version}: {name}")
+
+
+if __name__ == "__main__":
+    run_migrations()
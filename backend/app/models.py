@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Text, DateTime, func
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Text, DateTime, Index, func
 from sqlalchemy.orm import relationship
 
 from .db import Base
@@ -15,6 +15,7 @@ class User(Base):
 
     messages = relationship("Message", back_populates="user")
     memberships = relationship("ChatMember", back_populates="user")
+    sessions = relationship("AuthSession", back_populates="user")
 
 
 class Chat(Base):
@@ -32,7 +33,10 @@ class ChatMember(Base):
     __tablename__ = "chat_members"
 
     chat_id = Column(Integer, ForeignKey("chats.id"), primary_key=True)
-    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    # PK начинается с chat_id, для "чаты пользователя" нужен отдельный индекс
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True, index=True)
+    # id последнего прочитанного сообщения — по нему считаем непрочитанные
+    last_read_message_id = Column(Integer, nullable=False, default=0, server_default="0")
 
     chat = relationship("Chat", back_populates="members")
     user = relationship("User", back_populates="memberships")
@@ -40,12 +44,52 @@ class ChatMember(Base):
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        # лента чата: WHERE chat_id = ? ORDER BY id — без сортировки в запросе
+        Index("ix_messages_chat_id_id", "chat_id", "id"),
+        # повторная отправка с тем же client_id упирается в индекс при вставке;
+        # client_id первым — bulk ищет уже принятые по client_id IN (...)
+        Index("ux_messages_client_id", "client_id", "user_id", unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    chat_id = Column(Integer, ForeignKey("chats.id"), index=True)
+    chat_id = Column(Integer, ForeignKey("chats.id"))
     user_id = Column(Integer, ForeignKey("users.id"), index=True)
     text = Column(Text, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # id, который сгенерировал клиент; у сообщений без него — NULL
+    client_id = Column(String(64), nullable=True)
 
     chat = relationship("Chat", back_populates="messages")
     user = relationship("User", back_populates="messages")
+
+
+class AuthSession(Base):
+    __tablename__ = "sessions"
+
+    # храним только sha256 от токена, сам токен знает лишь клиент
+    token_hash = Column(String(64), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(Integer, nullable=False)  # unix time
+
+    user = relationship("User", back_populates="sessions")
+
+
+class Revision(Base):
+    __tablename__ = "revisions"
+
+    # версия списка для ETag (см. revisions.py), растёт при каждом изменении
+    name = Column(String(64), primary_key=True)
+    revision = Column(Integer, nullable=False, default=0)
+
+
+class BusEvent(Base):
+    __tablename__ = "bus_events"
+
+    # общая лента событий для воркеров (backend "table" в bus.py)
+    id = Column(Integer, primary_key=True)
+    origin = Column(String(32), nullable=False)
+    kind = Column(String(32), nullable=False)
+    payload = Column(Text, nullable=False)
+    created_at = Column(Integer, nullable=False, index=True)  # unix time
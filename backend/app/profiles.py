@@ -0,0 +1,77 @@
+from collections import OrderedDict
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+from .config import settings
+
+
+class ProfileCache:
+    # LRU user_id -> {"id", "name", "display_name"} для подписей к сообщениям.
+    # Промахи дочитываются из БД одним запросом на всю пачку. Профиль меняет
+    # только update_user_profile: запись сбрасывает событие шины (profile_event),
+    # так что и в остальных воркерах тоже.
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: OrderedDict[int, dict] = OrderedDict()
+        # растёт при каждом сбросе: загрузка, пересекшаяся со сбросом,
+        # не должна положить в кэш устаревший профиль
+        self._version = 0
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+
+    async def get(self, db: AsyncSession, user_id: int) -> dict | None:
+        return (await self.get_many(db, [user_id])).get(user_id)
+
+    async def get_many(self, db: AsyncSession, user_ids) -> dict[int, dict]:
+        # неизвестных id в ответе нет
+        found: dict[int, dict] = {}
+        missing = []
+        for user_id in dict.fromkeys(user_ids):
+            profile = self._entries.get(user_id)
+            if profile is None:
+                missing.append(user_id)
+            else:
+                self._entries.move_to_end(user_id)
+                found[user_id] = profile
+        self.hits += len(found)
+        self.misses += len(missing)
+        if not missing:
+            return found
+
+        version = self._version
+        result = await db.execute(
+            select(models.User.id, models.User.name, models.User.display_name).where(
+                models.User.id.in_(missing)
+            )
+        )
+        self.loads += 1
+        for user_id, name, display_name in result.all():
+            profile = {"id": user_id, "name": name, "display_name": display_name}
+            found[user_id] = profile
+            if self._version == version:
+                self._put(user_id, profile)
+        return found
+
+    def _put(self, user_id: int, profile: dict):
+        self._entries[user_id] = profile
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        self._version += 1
+        self._entries.pop(user_id, None)
+
+    def metrics(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "loads": self.loads,
+        }
+
+
+profiles = ProfileCache(settings.profile_cache_size)
@@ -0,0 +1,170 @@
+import asyncio
+import json
+
+from fastapi import WebSocket, status
+
+
+class ConnectionHub:
+    # держит открытые websocket-подключения и рассылает им новые сообщения
+    def __init__(self):
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._by_chat: dict[int, set[WebSocket]] = {}
+        self._by_user: dict[int, set[WebSocket]] = {}
+        self._user_of: dict[WebSocket, int] = {}
+        # digest токена, с которым вошло подключение: по нему закрываем при отзыве
+        self._digest_of: dict[WebSocket, str] = {}
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+
+    def _call(self, fn, *args):
+        # состояние хаба меняем только в потоке event loop,
+        # синхронные эндпоинты работают в threadpool
+        if self._loop is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            fn(*args)
+        else:
+            self._loop.call_soon_threadsafe(fn, *args)
+
+    # ---- подключения ----
+
+    def connect(self, ws: WebSocket, user_id: int, chat_ids: list[int], digest: str):
+        self._user_of[ws] = user_id
+        self._digest_of[ws] = digest
+        self._by_user.setdefault(user_id, set()).add(ws)
+        for chat_id in chat_ids:
+            self._by_chat.setdefault(chat_id, set()).add(ws)
+
+    def disconnect(self, ws: WebSocket):
+        user_id = self._user_of.pop(ws, None)
+        self._digest_of.pop(ws, None)
+        if user_id is not None:
+            conns = self._by_user.get(user_id)
+            if conns is not None:
+                conns.discard(ws)
+                if not conns:
+                    del self._by_user[user_id]
+        for chat_id in [cid for cid, conns in self._by_chat.items() if ws in conns]:
+            self._drop(chat_id, ws)
+
+    def _drop(self, chat_id: int, ws: WebSocket):
+        conns = self._by_chat.get(chat_id)
+        if conns is None:
+            return
+        conns.discard(ws)
+        if not conns:
+            del self._by_chat[chat_id]
+
+    # ---- подписки (меняются вместе с составом чата) ----
+
+    def subscribe(self, user_id: int, chat_id: int):
+        self._call(self._subscribe, user_id, chat_id)
+
+    def unsubscribe(self, user_id: int, chat_id: int):
+        self._call(self._unsubscribe, user_id, chat_id)
+
+    def _subscribe(self, user_id: int, chat_id: int):
+        for ws in self._by_user.get(user_id, ()):
+            self._by_chat.setdefault(chat_id, set()).add(ws)
+
+    def _unsubscribe(self, user_id: int, chat_id: int):
+        for ws in list(self._by_user.get(user_id, ())):
+            self._drop(chat_id, ws)
+
+    # ---- отзыв сессий ----
+
+    def close_session(self, digest: str):
+        self._call(self._close_sessions, None, digest, None)
+
+    def close_user_sessions(self, user_id: int, keep: str | None = None):
+        self._call(self._close_sessions, user_id, None, keep)
+
+    def _close_sessions(self, user_id: int | None, digest: str | None, keep: str | None):
+        if digest is not None:
+            conns = [ws for ws, d in self._digest_of.items() if d == digest]
+        else:
+            conns = [ws for ws in self._by_user.get(user_id, ()) if self._digest_of.get(ws) != keep]
+        for ws in conns:
+            # из рассылки убираем сразу, закрытие дойдёт до клиента позже
+            self.disconnect(ws)
+            asyncio.ensure_future(self._close(ws))
+
+    async def _close(self, ws: WebSocket):
+        try:
+            await ws.close(code=status.WS_1008_POLICY_VIOLATION)
+        except Exception:
+            pass
+
+    # ---- рассылка ----
+
+    def publish_message(self, data: dict):
+        # data — уже готовый к JSON словарь в формате MessageOut
+        if self._loop is None:
+            return
+        text = json.dumps({"type": "message", "message": data}, ensure_ascii=False)
+        self._call(self._schedule_broadcast, data["chat_id"], text)
+
+    def _schedule_broadcast(self, chat_id: int, text: str):
+        conns = self._by_chat.get(chat_id)
+        if conns:
+            asyncio.ensure_future(self._broadcast(list(conns), text))
+
+    async def _broadcast(self, conns: list[WebSocket], text: str):
+        for ws in conns:
+            try:
+                await ws.send_text(text)
+            except Exception:
+                # клиент отвалился — убираем его, остальным продолжаем слать
+                self.disconnect(ws)
+
+
+hub = ConnectionHub()
+
+
+class ChatNotifier:
+    # будит long-poll запросы, ждущие новых сообщений в чате
+    def __init__(self):
+        self._events: dict[int, asyncio.Event] = {}
+        # сколько запросов держат событие чата: от event() до release()
+        self._refs: dict[int, int] = {}
+
+    def event(self, chat_id: int) -> asyncio.Event:
+        # событие берём ДО запроса в БД: сообщение, пришедшее между запросом
+        # и ожиданием, всё равно его взведёт. Каждому event() — свой release()
+        self._refs[chat_id] = self._refs.get(chat_id, 0) + 1
+        ev = self._events.get(chat_id)
+        if ev is None:
+            ev = self._events[chat_id] = asyncio.Event()
+        return ev
+
+    def release(self, chat_id: int):
+        # событие удаляем, только когда его не держит ни один запрос: иначе
+        # взявший его, но ещё не дошедший до wait() не дождался бы notify()
+        self._refs[chat_id] -= 1
+        if not self._refs[chat_id]:
+            del self._refs[chat_id]
+            self._events.pop(chat_id, None)
+
+    async def wait(self, ev: asyncio.Event, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(ev.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def notify(self, chat_id: int):
+        # следующие ожидающие получат уже новое событие
+        ev = self._events.pop(chat_id, None)
+        if ev is not None:
+            ev.set()
+
+    def metrics(self) -> dict:
+        return {"chats": len(self._refs), "waiters": sum(self._refs.values())}
+
+
+notifier = ChatNotifier()
@@ -0,0 +1,37 @@
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+
+
+# Версии списков для ETag. Сообщения не меняются и не удаляются, поэтому
+# версия ленты — просто max(id) в чате (crud.get_last_message_id). Состав
+# чата меняется в обе стороны, ему нужен счётчик: его увеличивают
+# crud-функции в той же транзакции, что и само изменение.
+
+
+def chat_members(chat_id: int) -> str:
+    return f"chat:{chat_id}:members"
+
+
+def user_chats(user_id: int) -> str:
+    return f"user:{user_id}:chats"
+
+
+_BUMP = text(
+    "INSERT INTO revisions (name, revision) VALUES (:name, 1) "
+    "ON CONFLICT (name) DO UPDATE SET revision = revisions.revision + 1"
+)
+
+
+async def bump(db: AsyncSession, *names: str):
+    # без commit: фиксируется вместе с изменением, которое описывает
+    for name in names:
+        await db.execute(_BUMP, {"name": name})
+
+
+async def get(db: AsyncSession, name: str) -> int:
+    result = await db.execute(
+        select(models.Revision.revision).where(models.Revision.name == name)
+    )
+    return result.scalar() or 0
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
 
 class MessageBase(BaseModel):
@@ -7,6 +7,8 @@ class MessageBase(BaseModel):
 
 class MessageCreate(MessageBase):
     user_id: int
+    # id от клиента: повтор с тем же id вернёт уже созданное сообщение
+    client_id: str | None = Field(None, max_length=64)
 
 
 class MessageOut(MessageBase):
@@ -15,11 +17,42 @@ class MessageOut(MessageBase):
     user_id: int
     text: str
     created_at: datetime
+    client_id: str | None = None
 
     class Config:
         orm_mode = True
 
 
+class MessageBulkItem(MessageCreate):
+    chat_id: int
+
+
+class MessageBulkOut(BaseModel):
+    # id созданных сообщений в том же порядке, что и во входном списке
+    ids: list[int]
+
+
+class MessagePage(BaseModel):
+    items: list[MessageOut]
+    # курсор для следующего запроса в ту же сторону; None — дальше пусто
+    next_cursor: int | None = None
+
+
+class SearchHit(BaseModel):
+    id: int
+    chat_id: int
+    user_id: int
+    user_name: str
+    created_at: datetime
+    # фрагмент текста, совпадения обёрнуты в <b>…</b>
+    snippet: str
+
+
+class SearchPage(BaseModel):
+    items: list[SearchHit]
+    next_cursor: int | None = None
+
+
 class ChatCreate(BaseModel):
     title: str
     creator_id: int
@@ -33,6 +66,27 @@ class ChatOut(BaseModel):
         orm_mode = True
 
 
+class LastMessageOut(BaseModel):
+    id: int
+    user_id: int
+    user_name: str
+    text: str
+    created_at: datetime
+
+
+class ChatSummaryOut(BaseModel):
+    id: int
+    title: str
+    member_count: int
+    unread_count: int
+    last_read_message_id: int
+    last_message: LastMessageOut | None = None
+
+
+class ChatReadUpdate(BaseModel):
+    message_id: int
+
+
 class ChatMemberAdd(BaseModel):
     user_id: int
 
@@ -54,6 +108,25 @@ class UserOut(BaseModel):
         orm_mode = True
 
 
+class UserSearchHit(BaseModel):
+    id: int
+    name: str
+    display_name: str | None = None
+
+
+class UserSearchPage(BaseModel):
+    items: list[UserSearchHit]
+    # id последнего в выдаче — для следующей страницы
+    next_cursor: int | None = None
+
+
+class UserProfileOut(BaseModel):
+    id: int
+    name: str
+    # ник, а если его нет — логин
+    display_name: str
+
+
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -0,0 +1,129 @@
+import re
+import sys
+import time
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+# Полнотекстовый поиск по сообщениям (только SQLite): FTS5-таблица с внешним
+# содержимым — сам текст лежит в messages, здесь только индекс. Синхронизация
+# с messages — триггерами, так что её не обойти ни ORM, ни bulk-вставкой.
+# chat_id тоже проиндексирован: фильтр "чаты пользователя" идёт прямо в MATCH
+# и FTS пересекает списки документов вместо перебора всех совпадений по слову.
+
+FTS_TABLE = "messages_fts"
+
+FTS_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "text, chat_id, content='messages', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    f"CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN "
+    f"INSERT INTO {FTS_TABLE} (rowid, text, chat_id) VALUES (new.id, new.text, new.chat_id); END",
+    f"CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN "
+    f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, text, chat_id) "
+    f"VALUES ('delete', old.id, old.text, old.chat_id); END",
+    f"CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF text, chat_id ON messages BEGIN "
+    f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, text, chat_id) "
+    f"VALUES ('delete', old.id, old.text, old.chat_id); "
+    f"INSERT INTO {FTS_TABLE} (rowid, text, chat_id) VALUES (new.id, new.text, new.chat_id); END",
+    # в ранжировании участвует только текст
+    f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rank) VALUES ('rank', 'bm25(1.0, 0.0)')",
+]
+
+# Справочник пользователей — такой же индекс по name и display_name.
+# Ищем по мере набора: каждое слово — префикс, поэтому добавлены
+# prefix-индексы на 1–3 символа, иначе первая буква перебирает все слова
+# с таким началом. Выдача по rowid (= users.id), курсор — последний id.
+USERS_FTS_TABLE = "users_fts"
+
+USERS_FTS_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {USERS_FTS_TABLE} USING fts5("
+    "name, display_name, content='users', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='1 2 3')",
+    f"CREATE TRIGGER IF NOT EXISTS users_fts_ai AFTER INSERT ON users BEGIN "
+    f"INSERT INTO {USERS_FTS_TABLE} (rowid, name, display_name) "
+    f"VALUES (new.id, new.name, new.display_name); END",
+    f"CREATE TRIGGER IF NOT EXISTS users_fts_ad AFTER DELETE ON users BEGIN "
+    f"INSERT INTO {USERS_FTS_TABLE} ({USERS_FTS_TABLE}, rowid, name, display_name) "
+    f"VALUES ('delete', old.id, old.name, old.display_name); END",
+    f"CREATE TRIGGER IF NOT EXISTS users_fts_au AFTER UPDATE OF name, display_name ON users BEGIN "
+    f"INSERT INTO {USERS_FTS_TABLE} ({USERS_FTS_TABLE}, rowid, name, display_name) "
+    f"VALUES ('delete', old.id, old.name, old.display_name); "
+    f"INSERT INTO {USERS_FTS_TABLE} (rowid, name, display_name) "
+    f"VALUES (new.id, new.name, new.display_name); END",
+]
+
+MAX_TERMS = 8
+# больше чатов в фильтре — запрос MATCH слишком длинный, фильтруем join-ом
+MAX_CHAT_TERMS = 200
+_WORD = re.compile(r"\w+")
+
+
+def create_index(conn: Connection):
+    for ddl in FTS_DDL:
+        conn.execute(text(ddl))
+
+
+def rebuild(conn: Connection):
+    # перестраивает индекс целиком по содержимому messages
+    conn.execute(text(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')"))
+
+
+def create_users_index(conn: Connection):
+    for ddl in USERS_FTS_DDL:
+        conn.execute(text(ddl))
+
+
+def rebuild_users(conn: Connection):
+    conn.execute(text(f"INSERT INTO {USERS_FTS_TABLE} ({USERS_FTS_TABLE}) VALUES ('rebuild')"))
+
+
+def users_match_query(q: str) -> str | None:
+    # все слова — префиксами: "ив пе" найдёт "Иван Петров"
+    words = _WORD.findall(q)[:MAX_TERMS]
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def match_query(q: str, chat_ids=None) -> str | None:
+    # ввод пользователя не отдаём в MATCH как есть: кавычки, AND/OR/NEAR и
+    # "column:" — синтаксис FTS5. Берём слова, каждое в кавычках (все должны
+    # встретиться), последнее — префиксом, чтобы искать по мере набора
+    words = _WORD.findall(q)[:MAX_TERMS]
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    match = f"text:({' '.join(terms)})"
+    if chat_ids:
+        match = f"chat_id:({' OR '.join(str(int(c)) for c in chat_ids)}) AND {match}"
+    return match
+
+
+def main(argv: list[str]):
+    from .db import engine
+
+    if argv != ["rebuild"]:
+        print("usage: python -m app.search rebuild")
+        return 2
+    if engine.dialect.name != "sqlite":
+        print("full-text search is available on SQLite only")
+        return 1
+    t0 = time.perf_counter()
+    with engine.begin() as conn:
+        create_index(conn)
+        rebuild(conn)
+        count = conn.execute(text("SELECT count(*) FROM messages")).scalar()
+    print(f"{FTS_TABLE}: indexed {count} messages in {time.perf_counter() - t0:.1f}s")
+    t0 = time.perf_counter()
+    with engine.begin() as conn:
+        create_users_index(conn)
+        rebuild_users(conn)
+        count = conn.execute(text("SELECT count(*) FROM users")).scalar()
+    print(f"{USERS_FTS_TABLE}: indexed {count} users in {time.perf_counter() - t0:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
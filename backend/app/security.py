@@ -1,9 +1,99 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 from pwdlib import PasswordHash
+from pwdlib.hashers.argon2 import Argon2Hasher
+
+from .config import settings
 
-password_hash = PasswordHash.recommended()
+# параметры зашиты в сам хеш, поэтому старые хеши проверяются и после их смены
+password_hash = PasswordHash(
+    (
+        Argon2Hasher(
+            time_cost=settings.argon2_time_cost,
+            memory_cost=settings.argon2_memory_cost,
+            parallelism=settings.argon2_parallelism,
+        ),
+    )
+)
 
 def hash_password(password: str) -> str:
     return password_hash.hash(password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return password_hash.verify(plain_password, hashed_password)
+
+
+class PasswordPoolBusy(Exception):
+    pass
+
+
+class PasswordWorkerPool:
+    # Argon2 специально тяжёлый по CPU и памяти: считаем его в отдельных потоках
+    # (argon2-cffi отпускает GIL), а очередь ограничиваем, чтобы всплеск логинов
+    # не копил бесконечный хвост запросов
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.max_pending = self.workers + queue_size
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="argon2")
+
+        # счётчики меняются только в потоке event loop
+        self.pending = 0
+        self.peak_pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+        self.run_seconds = 0.0
+
+    async def run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise PasswordPoolBusy()
+
+        self.pending += 1
+        self.peak_pending = max(self.peak_pending, self.pending)
+        queued_at = time.perf_counter()
+
+        def job():
+            started_at = time.perf_counter()
+            return fn(*args), started_at, time.perf_counter()
+
+        try:
+            result, started_at, finished_at = await asyncio.get_running_loop().run_in_executor(
+                self._executor, job
+            )
+        finally:
+            self.pending -= 1
+
+        self.completed += 1
+        self.wait_seconds += started_at - queued_at
+        self.run_seconds += finished_at - started_at
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self.run(hash_password, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self.run(verify_password, plain_password, hashed_password)
+
+    def metrics(self) -> dict:
+        done = self.completed or 1
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "queued": max(0, self.pending - self.workers),
+            "peak_pending": self.peak_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(self.wait_seconds / done * 1000, 2),
+            "avg_run_ms": round(self.run_seconds / done * 1000, 2),
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+password_pool = PasswordWorkerPool(settings.password_workers, settings.password_queue_size)
@@ -0,0 +1,52 @@
+import secrets
+import time
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import crud
+from .auth_cache import auth_cache, token_digest
+from .bus import bus, session_event
+from .config import settings
+
+
+def new_token() -> str:
+    return secrets.token_urlsafe(32)
+
+
+async def issue_token(db: AsyncSession, user_id: int) -> str:
+    token = new_token()
+    now = int(time.time())
+    await crud.delete_expired_sessions(db, user_id, now)
+    await crud.create_session(db, user_id, token_digest(token), now + settings.session_ttl_seconds)
+    return token
+
+
+async def resolve_token(db: AsyncSession, token: str) -> dict | None:
+    digest = token_digest(token)
+    identity = auth_cache.get(digest)
+    if identity is not None:
+        return identity
+
+    row = await crud.get_session_user(db, digest)
+    if row is None or row.expires_at <= time.time():
+        return None
+    identity = {"id": row.id, "password": "", "name": row.name}
+    auth_cache.put(digest, identity, row.expires_at)
+    return identity
+
+
+# Отзыв: сначала удаляем сессию из БД, потом событием шины сбрасываем кэш
+# и закрываем websocket-подключения с этим токеном — во всех воркерах.
+# В обратном порядке параллельный запрос успел бы снова закэшировать сессию.
+
+
+async def revoke_token(db: AsyncSession, token: str):
+    digest = token_digest(token)
+    await crud.delete_session(db, digest)
+    await bus.publish(session_event(digest=digest))
+
+
+async def revoke_user_tokens(db: AsyncSession, user_id: int, keep_token: str | None = None):
+    keep = token_digest(keep_token) if keep_token else None
+    await crud.delete_user_sessions(db, user_id, keep=keep)
+    await bus.publish(session_event(user_id=user_id, keep=keep))
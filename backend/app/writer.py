@@ -0,0 +1,188 @@
+import asyncio
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from . import models
+from .bus import bus, message_event
+from .config import settings
+from .db import async_engine
+
+
+class WriterStopped(Exception):
+    pass
+
+
+class MessageWriter:
+    # Group commit для новых сообщений: запросы кладут строку в очередь и ждут
+    # future, один фоновый task пишет накопившееся одним INSERT ... RETURNING
+    # в одной транзакции. Очередь одна и пишется по порядку, поэтому порядок
+    # id внутри чата совпадает с порядком поступления.
+    def __init__(self, engine: AsyncEngine, max_rows: int, max_delay: float, queue_size: int):
+        self.engine = engine
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.queue_size = queue_size
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+        self._conn: AsyncConnection | None = None
+        self.batches = 0
+        self.rows = 0
+        self.largest_batch = 0
+        self.errors = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    async def start(self):
+        # своё соединение берём сразу: когда пул занят запросами, ждущими
+        # этот же writer, получить соединение из пула он бы уже не смог
+        self._conn = await self.engine.connect()
+        self._queue = asyncio.Queue(self.queue_size)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # новые сообщения больше не принимаем, уже принятые дописываем
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        await self._queue.put(None)
+        await task
+        # submit, ждавший места в полной очереди, мог положить строку уже
+        # после None — её тоже дописываем, иначе запрос ждал бы вечно
+        while not self._queue.empty():
+            batch = []
+            while len(batch) < self.max_rows and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is not None:
+                    batch.append(item)
+            if batch:
+                await self._flush(batch)
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+    async def submit(
+        self, chat_id: int, user_id: int, text: str, client_id: str | None = None
+    ) -> models.Message:
+        # writer остановлен (или останавливается) — вызывающий пишет сам
+        if not self.running:
+            raise WriterStopped()
+        fut = asyncio.get_running_loop().create_future()
+        params = {"chat_id": chat_id, "user_id": user_id, "text": text, "client_id": client_id}
+        # очередь ограничена: при переполнении запрос ждёт места (backpressure)
+        await self._queue.put((params, fut))
+        return await fut
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_rows:
+                timeout = deadline - loop.time()
+                try:
+                    if timeout <= 0:
+                        item = self._queue.get_nowait()
+                    else:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(self, batch: list):
+        try:
+            messages = await self._insert([params for params, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                params, fut = batch[0]
+                existing = None
+                if isinstance(e, IntegrityError) and params["client_id"] is not None:
+                    # повтор уже принятого сообщения — отвечаем им же, без рассылки
+                    existing = await self._find_accepted(params)
+                if existing is None:
+                    self.errors += 1
+                if not fut.done():
+                    if existing is not None:
+                        fut.set_result(existing)
+                    else:
+                        fut.set_exception(e)
+                return
+            self.errors += 1
+            # одна плохая строка не должна ронять всю пачку — пишем по одной
+            for item in batch:
+                await self._flush([item])
+            return
+
+        self.batches += 1
+        self.rows += len(messages)
+        self.largest_batch = max(self.largest_batch, len(messages))
+        # сначала рассылка, потом ответ — как и при обычной записи
+        await bus.publish_many([message_event(msg) for msg in messages])
+        for (_, fut), msg in zip(batch, messages):
+            if not fut.done():
+                fut.set_result(msg)
+
+    async def _insert(self, rows: list[dict]) -> list[models.Message]:
+        stmt = insert(models.Message).returning(
+            models.Message.id, models.Message.created_at, sort_by_parameter_order=True
+        )
+        if self._conn is None:
+            self._conn = await self.engine.connect()
+        try:
+            async with self._conn.begin():
+                created = (await self._conn.execute(stmt, rows)).all()
+        except Exception:
+            # после ошибки соединение могло сломаться — следующая пачка возьмёт новое
+            await self._conn.close()
+            self._conn = None
+            raise
+        return [
+            models.Message(id=msg_id, created_at=created_at, **params)
+            for params, (msg_id, created_at) in zip(rows, created)
+        ]
+
+    async def _find_accepted(self, params: dict) -> models.Message | None:
+        try:
+            if self._conn is None:
+                self._conn = await self.engine.connect()
+            async with self._conn.begin():
+                row = (
+                    await self._conn.execute(
+                        select(models.Message.__table__).where(
+                            models.Message.client_id == params["client_id"],
+                            models.Message.user_id == params["user_id"],
+                        )
+                    )
+                ).first()
+        except Exception:
+            return None
+        return models.Message(**row._mapping) if row is not None else None
+
+    def metrics(self) -> dict:
+        return {
+            "running": self.running,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "batches": self.batches,
+            "rows": self.rows,
+            "largest_batch": self.largest_batch,
+            "errors": self.errors,
+        }
+
+
+writer = MessageWriter(
+    async_engine,
+    max_rows=settings.write_batch_rows,
+    max_delay=settings.write_batch_delay_ms / 1000,
+    queue_size=settings.write_queue_size,
+)
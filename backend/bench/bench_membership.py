@@ -0,0 +1,80 @@
+# Стоимость проверки "пользователь состоит в чате": запрос в chat_members
+# на каждый вызов против MembershipIndex в памяти.
+#
+#   python bench/bench_membership.py --users 10000 --chats 2000 --checks 20000
+
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def seed(path: str, users: int, chats: int, per_user: int):
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE chat_members (chat_id INTEGER, user_id INTEGER,"
+        " last_read_message_id INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (chat_id, user_id))"
+    )
+    conn.execute("CREATE INDEX ix_chat_members_user_id ON chat_members (user_id)")
+    rnd = random.Random(1)
+    rows = {(rnd.randint(1, chats), u) for u in range(1, users + 1) for _ in range(per_user)}
+    conn.executemany("INSERT INTO chat_members (chat_id, user_id) VALUES (?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+
+async def run(args):
+    from app import crud
+    from app.db import AsyncSessionLocal, async_engine
+    from app.membership import MembershipIndex
+
+    rnd = random.Random(2)
+    checks = [(rnd.randint(1, args.users), rnd.randint(1, args.chats)) for _ in range(args.checks)]
+
+    async with AsyncSessionLocal() as db:
+        t0 = time.perf_counter()
+        for user_id, chat_id in checks:
+            await crud.get_chat_member(db, chat_id, user_id)
+            db.expunge_all()
+        per_query = (time.perf_counter() - t0) / len(checks)
+
+        index = MembershipIndex()
+        t0 = time.perf_counter()
+        for user_id, chat_id in checks:
+            await index.is_member(db, user_id, chat_id)
+        cold = (time.perf_counter() - t0) / len(checks)
+
+        t0 = time.perf_counter()
+        for user_id, chat_id in checks:
+            await index.is_member(db, user_id, chat_id)
+        warm = (time.perf_counter() - t0) / len(checks)
+
+    await async_engine.dispose()
+    print(f"{args.checks} checks, {args.users} users, {args.chats} chats")
+    print(f"query per check      {per_query * 1e6:9.1f} us/check")
+    print(f"index, first pass    {cold * 1e6:9.1f} us/check  (loads={index.loads})")
+    print(f"index, warm          {warm * 1e6:9.1f} us/check")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--chats", type=int, default=2_000)
+    parser.add_argument("--per-user", type=int, default=20)
+    parser.add_argument("--checks", type=int, default=20_000)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "membership.db")
+    seed(path, args.users, args.chats, args.per_user)
+    os.environ["RIPPLECHAT_DATABASE_URL"] = f"sqlite:///{path}"
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
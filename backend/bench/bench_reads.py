@@ -0,0 +1,173 @@
+# Горячие списки: ORM-сущности (как было) против выборки колонок
+# (crud.get_chat_messages, get_chat_members, get_all_users). Считаем строки
+# в секунду и память на запрос — пик tracemalloc за один вызов.
+#
+#   python bench/bench_reads.py --users 20000 --members 2000 --requests 300
+
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def seed(path: str, users: int, members: int, messages: int):
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        """
+        PRAGMA journal_mode=OFF;
+        PRAGMA synchronous=OFF;
+        CREATE TABLE users (id INTEGER PRIMARY KEY, name VARCHAR, display_name VARCHAR,
+                            hashed_password VARCHAR NOT NULL);
+        CREATE TABLE chats (id INTEGER PRIMARY KEY, title VARCHAR, is_group BOOLEAN);
+        CREATE TABLE chat_members (chat_id INTEGER, user_id INTEGER,
+                                   last_read_message_id INTEGER NOT NULL DEFAULT 0,
+                                   PRIMARY KEY (chat_id, user_id));
+        CREATE TABLE messages (
+            id INTEGER PRIMARY KEY, chat_id INTEGER, user_id INTEGER,
+            text TEXT NOT NULL, created_at DATETIME, client_id VARCHAR(64)
+        );
+        CREATE INDEX ix_messages_chat_id_id ON messages (chat_id, id);
+        INSERT INTO chats VALUES (1, 'bench', 1);
+        """
+    )
+    # хеш argon2 — около сотни байт, его раньше читал каждый GET /users
+    fake_hash = "$argon2id$v=19$m=65536,t=3,p=4$" + "x" * 22 + "$" + "y" * 43
+    conn.executemany(
+        "INSERT INTO users (id, name, display_name, hashed_password) VALUES (?, ?, ?, ?)",
+        ((i, f"user{i}", f"Пользователь {i}", fake_hash) for i in range(1, users + 1)),
+    )
+    rnd = random.Random(1)
+    conn.executemany(
+        "INSERT INTO chat_members (chat_id, user_id) VALUES (1, ?)",
+        ((u,) for u in rnd.sample(range(1, users + 1), members)),
+    )
+    conn.executemany(
+        "INSERT INTO messages (chat_id, user_id, text, created_at) VALUES (1, ?, ?, ?)",
+        (
+            (rnd.randint(1, users), f"сообщение номер {i}", "2024-01-01 12:00:00")
+            for i in range(messages)
+        ),
+    )
+    conn.commit()
+    conn.close()
+
+
+# ---- как было: ORM-сущности ----
+
+
+async def legacy_messages(db, chat_id: int, limit: int):
+    from sqlalchemy import select
+    from app import models
+
+    q = (
+        select(models.Message, models.User.name.label("user_name"))
+        .join(models.User, models.User.id == models.Message.user_id)
+        .where(models.Message.chat_id == chat_id)
+        .order_by(models.Message.id.desc())
+        .limit(limit)
+    )
+    result = []
+    for msg, user_name in (await db.execute(q)).all():
+        msg.user_name = user_name
+        result.append(msg)
+    result.reverse()
+    return result
+
+
+async def legacy_members(db, chat_id: int):
+    from sqlalchemy import select
+    from app import models
+
+    q = (
+        select(models.ChatMember, models.User.name.label("user_name"))
+        .join(models.User, models.User.id == models.ChatMember.user_id)
+        .where(models.ChatMember.chat_id == chat_id)
+    )
+    result = []
+    for m, user_name in (await db.execute(q)).all():
+        m.user_name = user_name
+        result.append(m)
+    return result
+
+
+async def legacy_users(db):
+    from sqlalchemy import select
+    from app import models
+
+    return (await db.execute(select(models.User))).scalars().all()
+
+
+async def measure(db, fn, requests: int) -> tuple[float, float, int]:
+    # rows/s по requests вызовам, затем пик памяти одного вызова
+    rows = 0
+    t0 = time.perf_counter()
+    for _ in range(requests):
+        rows += len(await fn(db))
+        db.expunge_all()
+    elapsed = time.perf_counter() - t0
+
+    tracemalloc.start()
+    result = await fn(db)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    db.expunge_all()
+    return rows / elapsed, elapsed / requests * 1000, peak
+
+
+async def run(args):
+    from app import crud
+    from app.db import AsyncSessionLocal, async_engine
+
+    cases = [
+        (
+            f"messages page ({args.page})",
+            lambda db: legacy_messages(db, 1, args.page),
+            lambda db: crud.get_chat_messages(db, 1, limit=args.page),
+        ),
+        (
+            f"chat members ({args.members})",
+            lambda db: legacy_members(db, 1),
+            lambda db: crud.get_chat_members(db, 1),
+        ),
+        (f"all users ({args.users})", legacy_users, crud.get_all_users),
+    ]
+    async with AsyncSessionLocal() as db:
+        for name, legacy, columns in cases:
+            print(f"\n== {name}")
+            # большие списки гоняем реже — примерно одинаковое число строк на случай
+            requests = max(3, args.requests * args.page // max(args.page, len(await columns(db))))
+            for label, fn in (("ORM entities", legacy), ("columns", columns)):
+                await measure(db, fn, 3)  # прогрев
+                rate, per_request, peak = await measure(db, fn, requests)
+                print(
+                    f"{label:14} {rate:12,.0f} rows/s  {per_request:8.3f} ms/request"
+                    f"  peak {peak / 1024:9.1f} KiB/request"
+                )
+    await async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--members", type=int, default=2_000)
+    parser.add_argument("--messages", type=int, default=50_000)
+    parser.add_argument("--page", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=300)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "reads.db")
+    seed(path, args.users, args.members, args.messages)
+    os.environ["RIPPLECHAT_DATABASE_URL"] = f"sqlite:///{path}"
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
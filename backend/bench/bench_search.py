@@ -0,0 +1,173 @@
+# Поиск по сообщениям на большой базе: FTS5 (crud.search_messages) против
+# LIKE '%слово%' по чатам пользователя. Заодно — время полной переиндексации.
+#
+#   python bench/bench_search.py --messages 1000000 --db /tmp/search.db
+#
+# База наполняется один раз и переиспользуется при повторных запусках.
+
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+LIKE = (
+    "SELECT m.id, m.chat_id, m.user_id, u.name, m.created_at, m.text "
+    "FROM messages m "
+    "JOIN chat_members cm ON cm.chat_id = m.chat_id AND cm.user_id = ? "
+    "JOIN users u ON u.id = m.user_id "
+    "WHERE m.text LIKE ? ORDER BY m.id DESC LIMIT 21"
+)
+
+
+def vocabulary(size: int) -> list[str]:
+    rnd = random.Random(3)
+    letters = "абвгдежзиклмнопрстуфхцчшэюя"
+    return ["".join(rnd.choice(letters) for _ in range(rnd.randint(3, 9))) for _ in range(size)]
+
+
+def seed(path: str, messages: int, chats: int, users: int, per_user: int, words: list[str]):
+    from app import search
+    from app.db import engine
+    from app.migrations import run_migrations
+
+    run_migrations(engine)
+    engine.dispose()
+
+    conn = sqlite3.connect(path)
+    conn.executescript("PRAGMA journal_mode=OFF; PRAGMA synchronous=OFF;")
+    # вставляем без триггеров, индекс строим одним rebuild — как для старой базы
+    for name in ("messages_fts_ai", "messages_fts_ad", "messages_fts_au"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+    conn.executemany(
+        "INSERT INTO users (id, name, hashed_password) VALUES (?, ?, '-')",
+        ((i, f"user{i}") for i in range(1, users + 1)),
+    )
+    conn.executemany(
+        "INSERT INTO chats (id, title, is_group) VALUES (?, ?, 1)",
+        ((i, f"chat{i}") for i in range(1, chats + 1)),
+    )
+    rnd = random.Random(1)
+    members = {(rnd.randint(1, chats), u) for u in range(1, users + 1) for _ in range(per_user)}
+    conn.executemany("INSERT INTO chat_members (chat_id, user_id) VALUES (?, ?)", members)
+
+    # частоты слов по Ципфу: есть и очень частые, и редкие
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+    cum = list(__import__("itertools").accumulate(weights))
+    batch = 100_000
+    for start in range(0, messages, batch):
+        n = min(batch, messages - start)
+        rows = [
+            (rnd.randint(1, chats), rnd.randint(1, users), " ".join(rnd.choices(words, cum_weights=cum, k=rnd.randint(4, 14))))
+            for _ in range(n)
+        ]
+        conn.executemany("INSERT INTO messages (chat_id, user_id, text) VALUES (?, ?, ?)", rows)
+        conn.commit()
+    conn.close()
+
+    with engine.begin() as c:
+        t0 = time.perf_counter()
+        search.rebuild(c)
+        print(f"rebuild of {messages} messages: {time.perf_counter() - t0:.1f}s")
+        search.create_index(c)
+    engine.dispose()
+
+
+async def measure_fts(users: list[int], q: str, chat_id=None, scoped=True) -> tuple[float, float]:
+    # как в GET /search/messages: чаты пользователя — в MATCH (scoped)
+    # или, для пользователей с очень большим числом чатов, join-ом
+    from app import crud, search
+    from app.db import AsyncSessionLocal
+    from app.membership import MembershipIndex
+
+    index = MembershipIndex()
+    timings = []
+    async with AsyncSessionLocal() as db:
+        for user_id in users:
+            chat_ids = [chat_id] if chat_id is not None else sorted(await index.chat_ids(db, user_id))
+            t0 = time.perf_counter()
+            match = search.match_query(q, chat_ids if scoped else None)
+            await crud.search_messages(db, match, member_id=None if scoped else user_id, limit=21)
+            timings.append((time.perf_counter() - t0) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95) - 1]
+
+
+def measure_like(path: str, users: list[int], q: str) -> tuple[float, float]:
+    conn = sqlite3.connect(path)
+    timings = []
+    for user_id in users:
+        t0 = time.perf_counter()
+        conn.execute(LIKE, (user_id, f"%{q}%")).fetchall()
+        timings.append((time.perf_counter() - t0) * 1000)
+    conn.close()
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95) - 1]
+
+
+async def run(args, words: list[str]):
+    from app.db import async_engine
+
+    conn = sqlite3.connect(args.db)
+    total = conn.execute("SELECT count(*) FROM messages").fetchone()[0]
+    freq = lambda w: conn.execute(
+        "SELECT count(*) FROM messages_fts WHERE messages_fts MATCH ?", (f'text:"{w}"',)
+    ).fetchone()[0]
+    cases = [
+        ("frequent word", words[0]),
+        ("mid-frequency word", words[200]),
+        ("rare word", words[-1]),
+        ("prefix (3 letters)", words[200][:3]),
+        ("two words", f"{words[5]} {words[50]}"),
+    ]
+    rnd = random.Random(2)
+    users = [rnd.randint(1, args.users) for _ in range(args.queries)]
+    print(f"{total} messages, {args.users} users, ~{args.per_user} chats each")
+
+    for name, q in cases:
+        hits = freq(q.split()[0])
+        p50, p95 = await measure_fts(users, q)
+        print(f"{name:22} fts   p50={p50:8.2f}ms p95={p95:8.2f}ms  ({hits} docs with first word)")
+        p50, p95 = await measure_fts(users, q, scoped=False)
+        print(f"{'':22} join  p50={p50:8.2f}ms p95={p95:8.2f}ms")
+        if " " not in q and args.like:
+            p50, p95 = measure_like(args.db, users[: max(5, args.queries // 10)], q)
+            print(f"{'':22} like  p50={p50:8.2f}ms p95={p95:8.2f}ms")
+    chat_id = conn.execute(
+        "SELECT chat_id FROM chat_members WHERE user_id = ?", (users[0],)
+    ).fetchone()[0]
+    for name, q in (("frequent, one chat", words[0]), ("mid-freq, one chat", words[200])):
+        p50, p95 = await measure_fts([users[0]] * args.queries, q, chat_id=chat_id)
+        print(f"{name:22} fts   p50={p50:8.2f}ms p95={p95:8.2f}ms")
+    conn.close()
+    await async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", default="/tmp/ripplechat_search.db")
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--chats", type=int, default=2_000)
+    parser.add_argument("--users", type=int, default=5_000)
+    parser.add_argument("--per-user", type=int, default=20)
+    parser.add_argument("--words", type=int, default=20_000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--no-like", dest="like", action="store_false", help="не мерить LIKE (медленно)")
+    args = parser.parse_args()
+
+    os.environ["RIPPLECHAT_DATABASE_URL"] = f"sqlite:///{args.db}"
+    words = vocabulary(args.words)
+    if not os.path.exists(args.db):
+        t0 = time.perf_counter()
+        seed(args.db, args.messages, args.chats, args.users, args.per_user, words)
+        print(f"seeded {args.messages} messages in {time.perf_counter() - t0:.1f}s")
+    asyncio.run(run(args, words))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+# Страница ленты от запроса до байтов ответа: ORM-объекты + pydantic
+# (как было) против строк колонок + orjson. Заодно — размер страницы
+# без сжатия, в gzip и brotli и время сжатия.
+#
+#   python bench/bench_serialization.py --messages 100000 --pages 500
+
+import argparse
+import asyncio
+import gzip
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def seed(path: str, messages: int, chats: int, users: int):
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        """
+        PRAGMA journal_mode=OFF;
+        PRAGMA synchronous=OFF;
+        CREATE TABLE users (id INTEGER PRIMARY KEY, name VARCHAR, display_name VARCHAR,
+                            hashed_password VARCHAR NOT NULL);
+        CREATE TABLE messages (
+            id INTEGER PRIMARY KEY, chat_id INTEGER, user_id INTEGER,
+            text TEXT NOT NULL, created_at DATETIME, client_id VARCHAR(64)
+        );
+        CREATE INDEX ix_messages_chat_id_id ON messages (chat_id, id);
+        """
+    )
+    conn.executemany(
+        "INSERT INTO users (id, name, hashed_password) VALUES (?, ?, 'x')",
+        ((i, f"user{i}") for i in range(1, users + 1)),
+    )
+    rnd = random.Random(1)
+    words = "привет как дела завтра встреча в офисе созвон отчёт готов спасибо".split()
+    conn.executemany(
+        "INSERT INTO messages (chat_id, user_id, text, created_at) VALUES (?, ?, ?, ?)",
+        (
+            (
+                rnd.randint(1, chats),
+                rnd.randint(1, users),
+                " ".join(rnd.choices(words, k=rnd.randint(3, 20))),
+                time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(1_700_000_000 + i)),
+            )
+            for i in range(messages)
+        ),
+    )
+    conn.commit()
+    conn.close()
+
+
+async def legacy_rows(db, chat_id: int, limit: int):
+    # как было: сущности Message + подложенный user_name
+    from sqlalchemy import select
+    from app import models
+
+    q = (
+        select(models.Message, models.User.name.label("user_name"))
+        .join(models.User, models.User.id == models.Message.user_id)
+        .where(models.Message.chat_id == chat_id)
+        .order_by(models.Message.id.desc())
+        .limit(limit)
+    )
+    msgs = []
+    for msg, user_name in (await db.execute(q)).all():
+        msg.user_name = user_name
+        msgs.append(msg)
+    msgs.reverse()
+    return msgs
+
+
+def legacy_encode(msgs) -> bytes:
+    # response_model=MessagePage: проверка по схеме и дамп pydantic
+    from app import schemas
+
+    page = schemas.MessagePage.model_validate(
+        {"items": msgs, "next_cursor": None}, from_attributes=True
+    )
+    return page.model_dump_json().encode()
+
+
+async def fast_rows(db, chat_id: int, limit: int):
+    from app import crud
+
+    return await crud.get_chat_messages(db, chat_id=chat_id, limit=limit)
+
+
+def fast_encode(rows) -> bytes:
+    import orjson
+    from app.main import row_dicts
+
+    return orjson.dumps({"items": row_dicts(rows), "next_cursor": None})
+
+
+async def measure(fetch, encode, chats: list[int], limit: int):
+    from app.db import AsyncSessionLocal
+
+    total, encoding = [], []
+    body = b""
+    async with AsyncSessionLocal() as db:
+        for chat_id in chats:
+            t0 = time.perf_counter()
+            rows = await fetch(db, chat_id, limit)
+            t1 = time.perf_counter()
+            body = encode(rows)
+            t2 = time.perf_counter()
+            total.append((t2 - t0) * 1000)
+            encoding.append((t2 - t1) * 1000)
+            db.expunge_all()
+    return statistics.median(total), statistics.median(encoding), body
+
+
+def compression(body: bytes):
+    import brotli
+
+    for name, compress in (
+        ("gzip -6", lambda b: gzip.compress(b, compresslevel=6, mtime=0)),
+        ("br q5", lambda b: brotli.compress(b, quality=5)),
+    ):
+        t0 = time.perf_counter()
+        for _ in range(50):
+            out = compress(body)
+        ms = (time.perf_counter() - t0) / 50 * 1000
+        print(f"  {name:8} {len(out):7} B  ({len(out) / len(body):5.1%})  {ms:6.3f} ms")
+
+
+async def run(args):
+    from app.db import async_engine
+
+    rnd = random.Random(2)
+    chats = [rnd.randint(1, args.chats) for _ in range(args.pages)]
+    for limit in (50, 200):
+        print(f"\n== page of {limit}")
+        for name, fetch, encode in (
+            ("ORM + pydantic", legacy_rows, legacy_encode),
+            ("columns + orjson", fast_rows, fast_encode),
+        ):
+            await measure(fetch, encode, chats[:20], limit)  # прогрев
+            total, encoding, body = await measure(fetch, encode, chats, limit)
+            print(f"{name:18} total p50={total:6.3f}ms  encode p50={encoding:6.3f}ms  {len(body)} B")
+        compression(body)
+    await async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--pages", type=int, default=500)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "serialization.db")
+    seed(path, args.messages, args.chats, args.users)
+    os.environ["RIPPLECHAT_DATABASE_URL"] = f"sqlite:///{path}"
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
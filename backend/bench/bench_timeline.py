@@ -0,0 +1,133 @@
+# Лента чата на большой базе: старый запрос (ORDER BY created_at + OFFSET,
+# одиночный индекс по chat_id) против keyset по (chat_id, id).
+#
+#   python bench/bench_timeline.py --messages 10000000 --db /tmp/timeline.db
+#
+# База наполняется один раз и переиспользуется при повторных запусках.
+
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import time
+
+LEGACY = (
+    "SELECT m.id, m.chat_id, m.user_id, m.text, m.created_at, u.name "
+    "FROM messages m JOIN users u ON u.id = m.user_id "
+    "WHERE m.chat_id = ? ORDER BY m.created_at DESC LIMIT 50 OFFSET ?"
+)
+KEYSET_LATEST = (
+    "SELECT m.id, m.chat_id, m.user_id, m.text, m.created_at, u.name "
+    "FROM messages m JOIN users u ON u.id = m.user_id "
+    "WHERE m.chat_id = ? AND m.id < ? ORDER BY m.id DESC LIMIT 50"
+)
+KEYSET_POLL = (
+    "SELECT m.id, m.chat_id, m.user_id, m.text, m.created_at, u.name "
+    "FROM messages m JOIN users u ON u.id = m.user_id "
+    "WHERE m.chat_id = ? AND m.id > ? ORDER BY m.id ASC LIMIT 50"
+)
+
+
+def seed(path: str, messages: int, chats: int, users: int):
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        """
+        PRAGMA journal_mode=OFF;
+        PRAGMA synchronous=OFF;
+        CREATE TABLE users (id INTEGER PRIMARY KEY, name VARCHAR);
+        CREATE TABLE messages (
+            id INTEGER PRIMARY KEY, chat_id INTEGER, user_id INTEGER,
+            text TEXT NOT NULL, created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+        """
+    )
+    conn.executemany(
+        "INSERT INTO users (id, name) VALUES (?, ?)",
+        ((i, f"user{i}") for i in range(1, users + 1)),
+    )
+    rnd = random.Random(1)
+    base = 1_700_000_000
+    batch = 200_000
+    for start in range(0, messages, batch):
+        rows = [
+            (
+                rnd.randint(1, chats),
+                rnd.randint(1, users),
+                f"message {i}",
+                time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(base + i)),
+            )
+            for i in range(start, min(start + batch, messages))
+        ]
+        conn.executemany(
+            "INSERT INTO messages (chat_id, user_id, text, created_at) VALUES (?, ?, ?, ?)",
+            rows,
+        )
+        conn.commit()
+    conn.close()
+
+
+def use_indexes(conn: sqlite3.Connection, composite: bool):
+    conn.execute("DROP INDEX IF EXISTS ix_messages_chat_id")
+    conn.execute("DROP INDEX IF EXISTS ix_messages_chat_id_id")
+    if composite:
+        conn.execute("CREATE INDEX ix_messages_chat_id_id ON messages (chat_id, id)")
+    else:
+        conn.execute("CREATE INDEX ix_messages_chat_id ON messages (chat_id)")
+    conn.execute("ANALYZE")
+    conn.commit()
+
+
+def measure(conn: sqlite3.Connection, sql: str, params: list[tuple]) -> tuple[float, float]:
+    timings = []
+    for p in params:
+        t0 = time.perf_counter()
+        conn.execute(sql, p).fetchall()
+        timings.append((time.perf_counter() - t0) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95) - 1]
+
+
+def plan(conn: sqlite3.Connection, sql: str, params: tuple) -> str:
+    rows = conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    return "; ".join(r[-1] for r in rows)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", default="/tmp/ripplechat_timeline.db")
+    parser.add_argument("--messages", type=int, default=10_000_000)
+    parser.add_argument("--chats", type=int, default=1_000)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        t0 = time.perf_counter()
+        seed(args.db, args.messages, args.chats, args.users)
+        print(f"seeded {args.messages} messages in {time.perf_counter() - t0:.1f}s")
+
+    conn = sqlite3.connect(args.db)
+    max_id = conn.execute("SELECT max(id) FROM messages").fetchone()[0]
+    rnd = random.Random(2)
+    chats = [rnd.randint(1, args.chats) for _ in range(args.queries)]
+
+    cases = [
+        ("latest page, legacy", LEGACY, [(c, 0) for c in chats]),
+        ("deep page, legacy (offset 5000)", LEGACY, [(c, 5000) for c in chats]),
+        ("latest page, keyset", KEYSET_LATEST, [(c, max_id + 1) for c in chats]),
+        ("deep page, keyset", KEYSET_LATEST, [(c, max_id // 2) for c in chats]),
+        ("steady-state poll, keyset", KEYSET_POLL, [(c, max_id) for c in chats]),
+    ]
+
+    for composite in (False, True):
+        use_indexes(conn, composite)
+        print(f"\n== index: {'(chat_id, id)' if composite else '(chat_id)'}")
+        for name, sql, params in cases:
+            p50, p95 = measure(conn, sql, params)
+            print(f"{name:34} p50={p50:8.2f}ms p95={p95:8.2f}ms")
+            print(f"{'':34} plan: {plan(conn, sql, params[0])}")
+
+
+if __name__ == "__main__":
+    main()
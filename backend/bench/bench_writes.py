@@ -0,0 +1,77 @@
+# Пропускная способность записи сообщений: commit на каждое сообщение
+# против write-behind (group commit через MessageWriter). Без HTTP —
+# меряется только работа с БД.
+#
+#   python bench/bench_writes.py --senders 50 --messages 4000
+#   RIPPLECHAT_SQLITE_SYNCHRONOUS=FULL python bench/bench_writes.py
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+async def send_all(args, chat_id: int, user_id: int) -> float:
+    from app import crud
+    from app.db import AsyncSessionLocal
+
+    per_sender = args.messages // args.senders
+
+    async def sender(n: int):
+        for i in range(per_sender):
+            async with AsyncSessionLocal() as db:
+                await crud.create_message(db, chat_id, user_id, f"sender {n} message {i}")
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(sender(n) for n in range(args.senders)))
+    return per_sender * args.senders / (time.perf_counter() - t0)
+
+
+async def run(args):
+    from app import models
+    from app.db import AsyncSessionLocal, async_engine, engine
+    from app.migrations import run_migrations
+    from app.writer import writer
+
+    run_migrations(engine)
+    async with AsyncSessionLocal() as db:
+        user = models.User(name="bench", hashed_password="-")
+        chat = models.Chat(title="bench", is_group=True)
+        db.add_all([user, chat])
+        await db.commit()
+        user_id, chat_id = user.id, chat.id
+
+    per_commit = await send_all(args, chat_id, user_id)
+
+    await writer.start()
+    batched = await send_all(args, chat_id, user_id)
+    await writer.stop()
+    metrics = writer.metrics()
+
+    await async_engine.dispose()
+    print(f"{args.messages} messages, {args.senders} concurrent senders")
+    print(f"commit per message   {per_commit:9.0f} msg/s")
+    print(
+        f"write-behind         {batched:9.0f} msg/s  "
+        f"(batches={metrics['batches']}, avg={metrics['rows'] / max(metrics['batches'], 1):.1f}, "
+        f"max={metrics['largest_batch']})"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--senders", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=4000)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "writes.db")
+    os.environ["RIPPLECHAT_DATABASE_URL"] = f"sqlite:///{path}"
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# Нагрузка на работающий сервер: N параллельных клиентов читают ленту чата
+# (или, с --send, пишут в неё).
+#
+#   uvicorn app.main:app --port 8000
+#   python bench/load_messages.py --user ira --password ira --concurrency 50
+#   python bench/load_messages.py --user ira --password ira --send --user-id 1
+#
+# Печатает req/s и p50/p95/p99 задержки; запускать до и после изменения.
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+async def worker(client: httpx.AsyncClient, send, deadline: float, timings: list, errors: list):
+    while time.perf_counter() < deadline:
+        t0 = time.perf_counter()
+        try:
+            resp = await send(client)
+            resp.raise_for_status()
+        except httpx.HTTPError as e:
+            errors.append(e)
+            continue
+        timings.append((time.perf_counter() - t0) * 1000)
+
+
+async def run(args):
+    async with httpx.AsyncClient(base_url=args.url, timeout=30) as client:
+        resp = await client.post("/login", data={"username": args.user, "password": args.password})
+        resp.raise_for_status()
+        token = resp.json()["access_token"]
+
+    limits = httpx.Limits(max_connections=args.concurrency)
+    headers = {"Authorization": f"Bearer {token}"}
+    url = f"/chats/{args.chat_id}/messages"
+    if args.send:
+        body = {"user_id": args.user_id, "text": "load test message"}
+        send = lambda client: client.post(url, json=body)
+    else:
+        params = {"limit": args.limit}
+        if args.after_id is not None:
+            params["after_id"] = args.after_id
+        send = lambda client: client.get(url, params=params)
+
+    timings: list[float] = []
+    errors: list = []
+    async with httpx.AsyncClient(base_url=args.url, headers=headers, limits=limits, timeout=30) as client:
+        deadline = time.perf_counter() + args.seconds
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(
+                worker(client, send, deadline, timings, errors)
+                for _ in range(args.concurrency)
+            )
+        )
+        elapsed = time.perf_counter() - started
+
+    timings.sort()
+    if not timings:
+        print(f"no successful requests, {len(errors)} errors")
+        return
+    pct = lambda q: timings[min(len(timings) - 1, int(len(timings) * q))]
+    print(
+        f"concurrency={args.concurrency} requests={len(timings)} errors={len(errors)} "
+        f"rps={len(timings) / elapsed:.0f} p50={statistics.median(timings):.1f}ms "
+        f"p95={pct(0.95):.1f}ms p99={pct(0.99):.1f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--user", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--chat-id", type=int, default=1)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--after-id", type=int)
+    parser.add_argument("--send", action="store_true", help="POST сообщений вместо чтения ленты")
+    parser.add_argument("--user-id", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--seconds", type=float, default=10)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
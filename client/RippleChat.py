@@ -5,13 +5,14 @@ from kivymd.uix.boxlayout import MDBoxLayout
 from kivymd.uix.toolbar import MDTopAppBar
 from kivymd.uix.textfield import MDTextField
 from kivymd.uix.button import MDFloatingActionButton
-from kivymd.uix.list import MDList, OneLineListItem
+from kivymd.uix.list import MDList, OneLineListItem, TwoLineListItem
 from kivymd.uix.label import MDLabel
 from kivymd.uix.scrollview import MDScrollView
+from kivymd.uix.recycleview import MDRecycleView
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
 from kivy.uix.screenmanager import ScreenManager, NoTransition
 from kivy.metrics import dp
 from kivy.clock import Clock
-import requests
 from kivymd.uix.dialog import MDDialog
 from kivymd.uix.button import MDFlatButton
 
@@ -24,16 +25,99 @@ from kivy.uix.anchorlayout import AnchorLayout
 
 from kivymd.uix.card import MDCard
 
-from kivy.utils import get_color_from_hex
+from kivy.utils import escape_markup, get_color_from_hex
 
 from kivymd.uix.list import OneLineAvatarIconListItem, IconRightWidget
 from kivymd.uix.button import MDIconButton
 
-from kivy.properties import BooleanProperty
+from kivy.properties import BooleanProperty, NumericProperty, StringProperty
 from kivymd.uix.button import MDRaisedButton
 
+import json
+import os
+import threading
+import time
+import uuid
+
+from api_client import ApiClient, RequestGroup
+from local_cache import LocalCache
+
+try:
+    import websocket  # пакет websocket-client
+except ImportError:
+    websocket = None
+
 
 API_BASE_URL = "http://127.0.0.1:8000"  #   http://213.171.24.188:8000   http://127.0.0.1:8000
+WS_URL = API_BASE_URL.replace("http", "ws", 1) + "/ws"
+POLL_INTERVAL = 3  # пауза между запросами, если сервер не держит long-poll
+LONG_POLL_WAIT = 25  # сколько сервер держит запрос, если новых сообщений нет
+SEARCH_DELAY = 0.4  # пауза после ввода, прежде чем искать
+# Сколько строк держит лента, пока пользователь внизу чата: раскладка
+# RecycleBoxLayout пересчитывает все строки, так что кадр зависит от длины
+# ленты, а не от истории чата. Старые догружаются прокруткой вверх.
+MESSAGE_WINDOW = 300
+SYNC_PAGE = 200  # страница дельты after_id: после долгого перерыва их может быть много
+HISTORY_PAGE = 50  # страница истории при прокрутке вверх
+OUTBOX_BATCH = 100  # сколько сообщений outbox уходит одним запросом
+OUTBOX_RETRY_MIN = 1  # пауза перед повтором после ошибки сети, дальше удваивается
+OUTBOX_RETRY_MAX = 60
+PROFILES_BATCH = 200  # сколько id отправителей уходит в одном /users/profiles
+
+
+class MessageStream: # push новых сообщений по websocket
+    def __init__(self, token, on_message, on_state):
+        self.token = token
+        self.on_message = on_message
+        self.on_state = on_state
+        self._ws = None
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        if websocket is None:
+            print("websocket-client не установлен, остаёмся на опросе")
+            return
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        if self._ws is not None:
+            self._ws.close()
+
+    def _run(self):
+        delay = 1
+        while not self._stopped:
+            self._ws = websocket.WebSocketApp(
+                WS_URL,
+                on_open=self._on_open,
+                on_message=self._on_message,
+                on_close=self._on_close,
+            )
+            self._ws.run_forever(ping_interval=30, ping_timeout=10)
+            if self._stopped:
+                break
+            # переподключаемся с нарастающей паузой
+            time.sleep(delay)
+            delay = min(delay * 2, 30)
+
+    def _on_open(self, ws):
+        ws.send(json.dumps({"token": self.token}))
+
+    def _on_message(self, ws, raw):
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            return
+        # в UI отдаём только через Clock — мы сейчас в фоновом потоке
+        if data.get("type") == "ready":
+            Clock.schedule_once(lambda dt: self.on_state(True))
+        elif data.get("type") == "message":
+            Clock.schedule_once(lambda dt: self.on_message(data["message"]))
+
+    def _on_close(self, ws, *args):
+        if not self._stopped:
+            Clock.schedule_once(lambda dt: self.on_state(False))
 
 
 class LoginScreen(MDScreen): #авторизация
@@ -89,34 +173,33 @@ class LoginScreen(MDScreen): #авторизация
             print("Пустой логин или пароль")
             return
 
-        try:
-            resp = requests.post(
-                f"{API_BASE_URL}/login",
-                data={"username": username, "password": password},
-                timeout=5,
-            )
-            print("LOGIN status:", resp.status_code)
-            print("LOGIN text:", resp.text)
-            resp.raise_for_status()
-            data = resp.json()
-        except Exception as e:
-            print("Ошибка логина:", e)
-            return
-
         app = MDApp.get_running_app()
         if app is None:
             print("Приложение MDApp ещё не запущено")
             return
-        
+
         app = cast(RippleChatApp, app)
 
+        app.api.login(
+            username,
+            password,
+            on_success=lambda data: self._on_login(app, username, data),
+            on_error=lambda e: print("Ошибка логина:", e),
+        )
+
+    def _on_login(self, app, username, data):
         app.api_token = data["access_token"]
         app.current_user_id = data["user_id"]
         app.current_username = username
 
-        print("TOKEN SET:", app.api_token, "USER_ID:", app.current_user_id)
+        # сам токен не печатаем: это действующий пароль сессии
+        print("LOGGED IN, USER_ID:", app.current_user_id)
 
+        app.open_cache()
+        app.start_message_stream()
         app.chat_list_screen.load_chats()
+        # то, что не успело уйти в прошлый раз
+        app.flush_outbox()
         app.sm.current = "chat_list"
 
 
@@ -131,6 +214,7 @@ class ChatListScreen(MDScreen): #страница чатов
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        self._requests = RequestGroup()
 
         root = MDBoxLayout(orientation="vertical")
 
@@ -174,40 +258,50 @@ class ChatListScreen(MDScreen): #страница чатов
         if not app.api_token or not app.current_user_id:
             print("Нет токена или user_id")
             return
-        if not app.api_token or not app.current_user_id:
-            print("Нет токена или user_id")
-            return
-
-        headers = {"Authorization": f"Bearer {app.api_token}"}
-        user_id = app.current_user_id
+        app = cast(RippleChatApp, app)
 
         self.current_user_label.text = f"Вы: {app.current_username}"
-        self.chat_list.clear_widgets()
-
-        try:
-            resp = requests.get(
-                f"{API_BASE_URL}/users/{user_id}/chats",
-                headers=headers,
-                timeout=5,
-            )
-            print("Chats status:", resp.status_code)
-            print("Chats text:", resp.text)
-            resp.raise_for_status()
-            data = resp.json()
-            print("Chats parsed json:", data, type(data))
-        except Exception as e:
-            print("Ошибка загрузки чатов:", e)
-            return
+        if not self.chat_list.children and app.cache is not None:
+            # сразу после входа показываем то, что было в прошлый раз
+            self._show_chats(app, app.cache.chats())
+
+        # список перезапрашивается на каждое новое сообщение — нужен только
+        # ответ на последний запрос
+        self._requests.cancel()
+        app.api.get_chat_summaries(
+            app.current_user_id,
+            group=self._requests,
+            on_success=lambda data: self._on_chats(app, data),
+            on_error=lambda e: print("Ошибка загрузки чатов:", e),
+        )
 
+    def _on_chats(self, app, data):
         if not isinstance(data, list):
             print("Ожидал список чатов, а пришло что-то другое")
             return
+        if app.cache is not None:
+            app.cache.save_chats(data)
+        self._show_chats(app, data)
 
+    def _show_chats(self, app, data):
+        self.chat_list.clear_widgets()
         for chat in data:
             chat_id = chat["id"]
             title = chat["title"]
-            item = OneLineListItem(
-                text=title,
+
+            text = title
+            if chat["unread_count"]:
+                text = f"{title}  ({chat['unread_count']})"
+
+            last = chat.get("last_message")
+            if last:
+                preview = f"{last['user_name']}: {last['text']}"
+            else:
+                preview = f"Участников: {chat['member_count']}"
+
+            item = TwoLineListItem(
+                text=text,
+                secondary_text=preview,
                 on_release=lambda inst, cid=chat_id, ct=title: app.open_chat(cid, ct),
             )
             self.chat_list.add_widget(item)
@@ -250,22 +344,12 @@ class ChatListScreen(MDScreen): #страница чатов
             print("Нет токена или user_id при создании чата")
             return
 
-        headers = {"Authorization": f"Bearer {app.api_token}"}
-        user_id = app.current_user_id
-
-        try:
-            resp = requests.post(
-                f"{API_BASE_URL}/chats",
-                json={"title": title, "creator_id": user_id},
-                headers=headers,
-                timeout=5,
-            )
-            resp.raise_for_status()
-        except Exception as e:
-            print("Ошибка создания чата:", e)
-            return
-
-        self.load_chats()
+        app.api.create_chat(
+            title,
+            app.current_user_id,
+            on_success=lambda data: self.load_chats(),
+            on_error=lambda e: print("Ошибка создания чата:", e),
+        )
 
     def open_profile(self, *args):
         app = MDApp.get_running_app()
@@ -275,14 +359,133 @@ class ChatListScreen(MDScreen): #страница чатов
         app.open_profile_screen()
 
 
+class LongPoller: # запасной канал, если websocket недоступен
+    def __init__(self, api, token, get_cursor, on_messages):
+        self.api = api
+        self.token = token
+        self.get_cursor = get_cursor  # -> (chat_id, last_id) открытого чата
+        self.on_messages = on_messages
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            chat_id, last_id = self.get_cursor()
+            if chat_id is None or last_id is None:
+                # чат ещё не загружен — ждём первую загрузку
+                self._stopped.wait(POLL_INTERVAL)
+                continue
+
+            started = time.monotonic()
+            try:
+                items = self.api.poll_messages(self.token, chat_id, last_id, LONG_POLL_WAIT)
+            except Exception as e:
+                print("Ошибка long-poll:", e)
+                self._stopped.wait(POLL_INTERVAL)
+                continue
+
+            if self._stopped.is_set():
+                break
+            if items:
+                Clock.schedule_once(lambda dt, items=items: self.on_messages(items))
+            elif time.monotonic() - started < 1:
+                # сервер ответил сразу и пусто — он не умеет ждать, не долбим его
+                self._stopped.wait(POLL_INTERVAL)
+
+
+class MessageRow(MDBoxLayout): # строка ленты сообщений
+    # Виджеты создаёт RecycleView только для видимых строк и переиспользует
+    # их при прокрутке: данные строки приходят через свойства ниже.
+    message_id = NumericProperty(0)
+    text = StringProperty("")
+    user = StringProperty("")
+    user_id = NumericProperty(0)
+    incoming = BooleanProperty(True)
+    pending = BooleanProperty(False)  # ещё в outbox, сервер не подтвердил
+
+    def __init__(self, **kwargs):
+        super().__init__(
+            orientation="horizontal",
+            padding=(dp(8), dp(4)),
+            size_hint_y=None,
+            **kwargs,
+        )
+        self.bind(minimum_height=self.setter("height"))
+
+        self.bubble = MDBoxLayout(
+            orientation="vertical",
+            padding=(dp(10), dp(6)),
+            size_hint_x=0.8,
+            radius=[dp(16), dp(16), dp(16), dp(16)],
+            size_hint_y=None,
+        )
+        self.bubble.bind(minimum_height=self.bubble.setter("height"))
+
+        self.label = MDLabel(
+            theme_text_color="Custom",
+            text_color=(0, 0, 0, 1),
+            halign="left",
+            valign="middle",
+            size_hint_y=None,
+        )
+        self.label.bind(width=lambda inst, val: setattr(inst, "text_size", (val, None)))
+        self.label.bind(
+            texture_size=lambda inst, val: setattr(inst, "height", val[1])
+        )
+        self.bubble.add_widget(self.label)
+        self.spacer = MDBoxLayout(size_hint_x=0.2)
+
+        self.bind(text=self._update_text, user=self._update_text, incoming=self._update_side)
+        self.bind(pending=self._update_pending)
+        self._update_side()
+
+    def _update_text(self, *args):
+        self.label.text = f"{self.user}: {self.text}"
+
+    def _update_pending(self, *args):
+        self.label.text_color = (0.5, 0.5, 0.5, 1) if self.pending else (0, 0, 0, 1)
+
+    def _update_side(self, *args):
+        self.bubble.md_bg_color = (1, 1, 1, 1) if self.incoming else (0.882, 0.996, 0.776, 1)
+        self.clear_widgets()
+        if self.incoming:
+            self.add_widget(self.bubble)
+            self.add_widget(self.spacer)
+        else:
+            self.add_widget(self.spacer)
+            self.add_widget(self.bubble)
+
+
 class RippleChatScreen(MDScreen): #Чат
     def __init__(self, chat_id=None, chat_title="Чат", **kwargs):
         super().__init__(**kwargs)
 
         self.chat_id = chat_id
         self.chat_title = chat_title
-        self.messages = []
+        self._message_ids = set()
+        self._last_id = None
+        self._read_id = 0
+        self._older_done = False
+        self._loading_older = False
+        self._loading = False
+        self._reload = False
+        self._synced_id = None
+        self._pending = {}  # client_id -> строка ленты неподтверждённого сообщения
         self.add_user_dialog = None
+        self.search_dialog = None
+        self._search_event = None
+        self._user_search_event = None
+        self._poller = None
+        # запросы открытого чата; при переключении чата их ответы уже не нужны
+        self._requests = RequestGroup()
+        self._search_requests = RequestGroup()
+        self._user_search_requests = RequestGroup()
 
         root = MDBoxLayout(orientation="vertical")
 
@@ -293,17 +496,21 @@ class RippleChatScreen(MDScreen): #Чат
             md_bg_color=(0.0, 0.48, 0.99, 1),
             specific_text_color=(1, 1, 1, 1),
             left_action_items=[["arrow-left", lambda x: self.go_back()]],
-            right_action_items=[["account-plus", lambda x: self.open_add_user_dialog()]],
+            right_action_items=[
+                ["magnify", lambda x: self.open_search_dialog()],
+                ["account-plus", lambda x: self.open_add_user_dialog()],
+            ],
         )
 
         def _on_top_bar_touch(instance, touch):
             # клик попал в область панели?
             if not instance.collide_point(*touch.pos):
                 return False
-            # ширина стрелки слева и плюса справа ~ 48dp каждая
+            # ширина стрелки слева и каждой иконки справа ~ 48dp
             from kivy.metrics import dp
             x = touch.x - instance.x
-            if x < dp(56) or x > instance.width - dp(56):
+            right = dp(8) + dp(48) * len(instance.right_action_items)
+            if x < dp(56) or x > instance.width - right:
                 # клики по иконкам
                 return False
             # середина панели
@@ -314,9 +521,18 @@ class RippleChatScreen(MDScreen): #Чат
 
         root.add_widget(self.top_bar)
 
-        self.scroll = MDScrollView()
-        self.chat_list = MDList()
-        self.scroll.add_widget(self.chat_list)
+        # лента — RecycleView: виджеты есть только у видимых строк, высоту
+        # строки RecycleBoxLayout берёт у виджета после раскладки текста
+        self.scroll = MDRecycleView(viewclass=MessageRow)
+        self.message_layout = RecycleBoxLayout(
+            orientation="vertical",
+            size_hint_y=None,
+            default_size=(None, dp(56)),
+            default_size_hint=(1, None),
+        )
+        self.message_layout.bind(minimum_height=self.message_layout.setter("height"))
+        self.scroll.add_widget(self.message_layout)
+        self.scroll.bind(scroll_y=self._on_scroll)
         root.add_widget(self.scroll)
 
         bottom = MDBoxLayout(
@@ -351,7 +567,34 @@ class RippleChatScreen(MDScreen): #Чат
 
         self.add_widget(root)
 
-        Clock.schedule_interval(lambda dt: self.load_messages(), 3)
+    def set_live(self, live: bool):
+        # live — сообщения приходят по websocket, иначе работает long-poll
+        if live:
+            self.stop_polling()
+            # за время без websocket могли прийти сообщения
+            self.load_messages()
+        else:
+            self.start_polling()
+
+    def start_polling(self):
+        app = MDApp.get_running_app()
+        if app is None or self._poller is not None:
+            return
+        app = cast(RippleChatApp, app)
+        if not app.api_token:
+            return
+        self._poller = LongPoller(
+            app.api,
+            app.api_token,
+            get_cursor=lambda: (self.chat_id, self._last_id),
+            on_messages=lambda items: [self.add_incoming(msg) for msg in items],
+        )
+        self._poller.start()
+
+    def stop_polling(self):
+        if self._poller is not None:
+            self._poller.stop()
+            self._poller = None
 
     def open_chat_info(self):
         if self.chat_id is None:
@@ -363,70 +606,137 @@ class RippleChatScreen(MDScreen): #Чат
         app.open_chat_members(self.chat_id, self.chat_title)
 
 
-    # ==== ДОБАВЛЕНИЕ ПОЛЬЗОВАТЕЛЯ В ЧАТ ====
+    # ==== ПОИСК ПО ЧАТУ ====
 
-    def open_add_user_dialog(self):
+    def open_search_dialog(self):
         if self.chat_id is None:
             return
 
+        content = MDBoxLayout(
+            orientation="vertical",
+            spacing=dp(8),
+            size_hint_y=None,
+            height=dp(400),
+        )
+        self.search_field = MDTextField(
+            hint_text="Поиск в чате",
+            mode="rectangle",
+            multiline=False,
+        )
+        self.search_field.bind(text=self._on_search_text)
+        self.search_field.bind(on_text_validate=lambda x: self.run_search())
+        self.search_results = MDList()
+        scroll = MDScrollView()
+        scroll.add_widget(self.search_results)
+        content.add_widget(self.search_field)
+        content.add_widget(scroll)
+
+        if self.search_dialog is not None:
+            self.search_dialog.dismiss()
+
+        self.search_dialog = MDDialog(
+            title="Поиск",
+            type="custom",
+            content_cls=content,
+            buttons=[
+                MDFlatButton(
+                    text="Закрыть",
+                    on_release=lambda x: (
+                        self.search_dialog.dismiss()
+                        if self.search_dialog is not None
+                        else None
+                    ),
+                ),
+            ],
+        )
+        self.search_dialog.open()
+
+    def _on_search_text(self, instance, value):
+        # ищем, когда пользователь перестал печатать
+        if self._search_event is not None:
+            self._search_event.cancel()
+        self._search_event = Clock.schedule_once(lambda dt: self.run_search(), SEARCH_DELAY)
+
+    def run_search(self, cursor=0):
+        if self._search_event is not None:
+            self._search_event.cancel()
+            self._search_event = None
+
+        q = self.search_field.text.strip()
+        if cursor == 0:
+            # ответы на прошлый текст запроса уже не нужны
+            self._search_requests.cancel()
+            self.search_results.clear_widgets()
+        if not q or self.chat_id is None:
+            return
+
         app = MDApp.get_running_app()
         if app is None:
             return
         app = cast(RippleChatApp, app)
 
-        headers = {"Authorization": f"Bearer {app.api_token}"}
+        app.api.search_messages(
+            q,
+            self.chat_id,
+            cursor,
+            group=self._search_requests,
+            on_success=lambda data: self._show_search(q, cursor, data),
+            on_error=lambda e: print("Ошибка поиска:", e),
+        )
 
-        # 1) Все пользователи
-        try:
-            resp_all = requests.get(
-                f"{API_BASE_URL}/users",
-                headers=headers,
-                timeout=5,
-            )
-            resp_all.raise_for_status()
-            all_users = resp_all.json()
-        except Exception as e:
-            print("Ошибка загрузки всех пользователей:", e)
+    def _show_search(self, q, cursor, data):
+        # ответ на уже изменённый запрос не показываем
+        if self.search_field.text.strip() != q:
             return
 
-        # 2) Участники чата
-        try:
-            resp_members = requests.get(
-                f"{API_BASE_URL}/chats/{self.chat_id}/members",
-                headers=headers,
-                timeout=5,
-            )
-            resp_members.raise_for_status()
-            members = resp_members.json()
-        except Exception as e:
-            print("Ошибка загрузки участников чата:", e)
+        if cursor == 0 and not data["items"]:
+            self.search_results.add_widget(OneLineListItem(text="Ничего не найдено"))
             return
 
-        member_ids = {m["user_id"] for m in members}
-        available_users = [u for u in all_users if u["id"] not in member_ids]
+        for hit in data["items"]:
+            # совпадения сервер отмечает <b>…</b>, остальное экранируем от kivy-разметки
+            snippet = escape_markup(hit["snippet"]).replace("<b>", "[b]").replace("</b>", "[/b]")
+            created = hit["created_at"][:16].replace("T", " ")
+            self.search_results.add_widget(
+                TwoLineListItem(text=snippet, secondary_text=f"{hit['user_name']} · {created}")
+            )
 
-        print("ALL_USERS:", all_users)
-        print("MEMBERS:", members)
-        print("AVAILABLE_USERS:", available_users)
+        if data.get("next_cursor") is not None:
+            more = OneLineListItem(text="Показать ещё")
 
-        if not available_users:
-            print("Нет пользователей для добавления")
-            return
+            def on_more(item, next_cursor=data["next_cursor"]):
+                self.search_results.remove_widget(item)
+                self.run_search(next_cursor)
 
-        # 3) content_cls = сам MDList
-        lst = MDList()
+            more.bind(on_release=on_more)
+            self.search_results.add_widget(more)
 
-        def on_user_click(item):
-            user_id = item.user_id
-            self._add_user_to_chat_by_id(user_id)
-            if self.add_user_dialog is not None:
-                self.add_user_dialog.dismiss()
+    # ==== ДОБАВЛЕНИЕ ПОЛЬЗОВАТЕЛЯ В ЧАТ ====
 
-        for u in available_users:
-            item = OneLineListItem(text=u["name"])
-            item.user_id = u["id"]
-            item.bind(on_release=on_user_click)
-            lst.add_widget(item)
+    def open_add_user_dialog(self):
+        if self.chat_id is None:
+            return
+
+        # справочник ищет сервер по мере ввода, участников чата он сам
+        # исключает; пустой запрос — первые пользователи по порядку
+        content = MDBoxLayout(
+            orientation="vertical",
+            spacing=dp(8),
+            size_hint_y=None,
+            height=dp(400),
+        )
+        self.user_search_field = MDTextField(
+            hint_text="Имя или ник",
+            mode="rectangle",
+            multiline=False,
+        )
+        self.user_search_field.bind(text=self._on_user_search_text)
+        self.user_search_field.bind(on_text_validate=lambda x: self.run_user_search())
+        self.user_results = MDList()
+        scroll = MDScrollView()
+        scroll.add_widget(self.user_results)
+        content.add_widget(self.user_search_field)
+        content.add_widget(scroll)
 
         if self.add_user_dialog is not None:
             self.add_user_dialog.dismiss()
@@ -434,7 +744,7 @@ class RippleChatScreen(MDScreen): #Чат
         self.add_user_dialog = MDDialog(
             title="Добавить пользователя",
             type="custom",
-            content_cls=lst,
+            content_cls=content,
             buttons=[
                 MDFlatButton(
                     text="Отмена",
@@ -446,32 +756,89 @@ class RippleChatScreen(MDScreen): #Чат
                 ),
             ],
         )
+        self.add_user_dialog.open()
+        self.run_user_search()
+
+    def _on_user_search_text(self, instance, value):
+        if self._user_search_event is not None:
+            self._user_search_event.cancel()
+        self._user_search_event = Clock.schedule_once(
+            lambda dt: self.run_user_search(), SEARCH_DELAY
+        )
 
-        if self.add_user_dialog is not None:
-            self.add_user_dialog.open()
+    def run_user_search(self, cursor=0):
+        if self._user_search_event is not None:
+            self._user_search_event.cancel()
+            self._user_search_event = None
+
+        q = self.user_search_field.text.strip()
+        if cursor == 0:
+            self._user_search_requests.cancel()
+            self.user_results.clear_widgets()
+        if self.chat_id is None:
+            return
 
-    def _add_user_to_chat_by_id(self, user_id: int):
         app = MDApp.get_running_app()
         if app is None:
             return
         app = cast(RippleChatApp, app)
 
-        headers = {"Authorization": f"Bearer {app.api_token}"}
-        payload = {"user_id": user_id}
+        app.api.search_users(
+            q,
+            exclude_chat_id=self.chat_id,
+            cursor=cursor,
+            group=self._user_search_requests,
+            on_success=lambda data: self._show_user_search(q, cursor, data),
+            on_error=lambda e: print("Ошибка поиска пользователей:", e),
+        )
 
-        try:
-            resp = requests.post(
-                f"{API_BASE_URL}/chats/{self.chat_id}/members",
-                json=payload,
-                headers=headers,
-                timeout=5,
-            )
-            print("ADD MEMBER status:", resp.status_code, resp.text)
-            resp.raise_for_status()
-        except Exception as e:
-            print("Ошибка добавления пользователя в чат:", e)
+    def _show_user_search(self, q, cursor, data):
+        if self.user_search_field.text.strip() != q:
+            return
+
+        app = MDApp.get_running_app()
+        if app is not None and app.cache is not None:
+            app.cache.save_users(data["items"])
+
+        if cursor == 0 and not data["items"]:
+            self.user_results.add_widget(OneLineListItem(text="Никого не найдено"))
             return
 
+        def on_user_click(item):
+            self._add_user_to_chat_by_id(item.user_id)
+            if self.add_user_dialog is not None:
+                self.add_user_dialog.dismiss()
+
+        for u in data["items"]:
+            display = u.get("display_name")
+            label = f"{display} ({u['name']})" if display and display != u["name"] else u["name"]
+            item = OneLineListItem(text=label)
+            item.user_id = u["id"]
+            item.bind(on_release=on_user_click)
+            self.user_results.add_widget(item)
+
+        if data.get("next_cursor") is not None:
+            more = OneLineListItem(text="Показать ещё")
+
+            def on_more(item, next_cursor=data["next_cursor"]):
+                self.user_results.remove_widget(item)
+                self.run_user_search(next_cursor)
+
+            more.bind(on_release=on_more)
+            self.user_results.add_widget(more)
+
+    def _add_user_to_chat_by_id(self, user_id: int):
+        app = MDApp.get_running_app()
+        if app is None:
+            return
+        app = cast(RippleChatApp, app)
+
+        app.api.add_member(
+            self.chat_id,
+            user_id,
+            on_error=lambda e: print("Ошибка добавления пользователя в чат:", e),
+        )
+
     def _add_user_to_chat(self):
         text = self.add_user_field.text.strip()
         if not text:
@@ -485,33 +852,44 @@ class RippleChatScreen(MDScreen): #Чат
         if self.add_user_dialog is not None:
             self.add_user_dialog.dismiss()
 
-        app = MDApp.get_running_app()
-        if app is None:
-            return
-        app = cast(RippleChatApp, app)
-
-        headers = {"Authorization": f"Bearer {app.api_token}"}
-        payload = {"user_id": user_id}
-
-        try:
-            resp = requests.post(
-                f"{API_BASE_URL}/chats/{self.chat_id}/members",
-                json=payload,
-                headers=headers,
-                timeout=5,
-            )
-            print("ADD MEMBER status:", resp.status_code, resp.text)
-            resp.raise_for_status()
-        except Exception as e:
-            print("Ошибка добавления пользователя в чат:", e)
-            return
+        self._add_user_to_chat_by_id(user_id)
 
     # ==== ЛОГИКА ЧАТА ====
 
     def set_chat(self, chat_id, chat_title):
+        # ответы по прошлому чату отбрасываем, флаги загрузки сбрасываем:
+        # отменённые запросы своих колбэков уже не вызовут
+        self._requests.cancel()
+        self._search_requests.cancel()
+        self._user_search_requests.cancel()
         self.chat_id = chat_id
         self.chat_title = chat_title
         self.top_bar.title = self.chat_title
+        self._message_ids = set()
+        self._last_id = None
+        self._read_id = 0
+        self._older_done = False
+        self._loading_older = False
+        self._loading = False
+        self._reload = False
+        self._synced_id = None
+        self._pending = {}
+        self.scroll.data = []
+
+        app = MDApp.get_running_app()
+        if app is not None and chat_id is not None:
+            app = cast(RippleChatApp, app)
+            if app.cache is not None:
+                # показываем сохранённое сразу, с сервера берём только дельту
+                self._synced_id = app.cache.synced_id(chat_id)
+                cached = app.cache.last_messages(chat_id, MESSAGE_WINDOW)
+                for msg in cached:
+                    self._remember(msg)
+                views = [self._to_view(msg, app) for msg in cached]
+                # неотправленное — в конце ленты, как было перед закрытием
+                for item in app.cache.outbox(chat_id=chat_id):
+                    views.append(self._pending_view(app, item["client_id"], item["text"]))
+                self._show(views)
         self.load_messages()
 
 
@@ -521,6 +899,7 @@ class RippleChatScreen(MDScreen): #Чат
             return
         app = cast(RippleChatApp, app)
         app.sm.current = "chat_list"
+        app.chat_list_screen.load_chats()
 
     def load_messages(self, *args):
         if self.chat_id is None:
@@ -536,50 +915,119 @@ class RippleChatScreen(MDScreen): #Чат
             print("Нет токена при загрузке сообщений")
             return
 
-        headers = {"Authorization": f"Bearer {app.api_token}"}
-        print("HEADERS FOR MESSAGES:", headers)
+        if self._loading:
+            # одна загрузка за раз, иначе страницы лягут в ленту не по порядку
+            self._reload = True
+            return
 
-        try:
-            resp = requests.get(
-                f"{API_BASE_URL}/chats/{self.chat_id}/messages",
-                headers=headers,
-                timeout=5,
-            )
-            print("MSG status:", resp.status_code)
-            print("MSG text:", resp.text)
-            resp.raise_for_status()
-            data = resp.json()
-        except Exception as e:
+        # первый раз берём последнее окно, дальше — только то, что новее last_id
+        after_id = self._last_id
+
+        def on_error(e):
             print("Ошибка загрузки сообщений:", e)
+            self._loading = False
+
+        self._loading = True
+        self._reload = False
+        app.api.get_messages(
+            self.chat_id,
+            after_id=after_id,
+            limit=SYNC_PAGE if after_id is not None else None,
+            group=self._requests,
+            on_success=lambda data: self._on_messages(app, after_id, data),
+            on_error=on_error,
+        )
+
+    def _on_messages(self, app, after_id, data):
+        self._loading = False
+        if not isinstance(data, dict) or not isinstance(data.get("items"), list):
+            print("Ожидал страницу сообщений, а пришло:", type(data), data)
             return
 
-        if not isinstance(data, list):
-            print("Ожидал список сообщений, а пришло:", type(data), data)
-            return
-
-        self.messages = []
-        for msg in data:
-            user_display = msg.get("user_name")
-            if not user_display:
-                uid = msg["user_id"]
-                if uid == 1:
-                    user_display = "Ира"
-                elif uid == 2:
-                    user_display = "Мама"
-                elif uid == 3:
-                    user_display = "Сева"
-                else:
-                    user_display = f"User {uid}"
-
-            self.messages.append(
-                {
-                    "text": msg["text"],
-                    "user": user_display,
-                    "incoming": msg["user_id"] != app.current_user_id,
-                }
-            )
+        # в кэш — только если страница продолжает его отрезок без пропусков
+        if after_id is None or after_id == self._synced_id:
+            self._save_synced(app, data["items"])
+
+        for msg in data["items"]:
+            if msg.get("client_id") in self._pending:
+                self.confirm_sent(msg["client_id"], msg["id"])
+        new = [msg for msg in data["items"] if msg["id"] not in self._message_ids]
+        for msg in data["items"]:
+            self._remember(msg)
+        if new:
+            self._show([self._to_view(msg, app) for msg in new])
+            self.mark_read()
+
+        # в after-режиме полная страница — догружаем остаток; то же, если
+        # пока шёл запрос, пришли новые сообщения
+        if (after_id is not None and data.get("next_cursor") is not None and new) or self._reload:
+            Clock.schedule_once(lambda dt: self.load_messages())
+
+    def _save_synced(self, app, items):
+        if app.cache is None or not items:
+            return
+        app.cache.save_messages(self.chat_id, items, synced=True)
+        self._synced_id = max(self._synced_id or 0, max(msg["id"] for msg in items))
+
+    def _remember(self, msg):
+        self._message_ids.add(msg["id"])
+        if self._last_id is None or msg["id"] > self._last_id:
+            self._last_id = msg["id"]
+
+    def _to_view(self, msg, app):
+        return {
+            "message_id": msg["id"],
+            "text": msg["text"],
+            "user": app.display_name(msg["user_id"]),
+            "user_id": msg["user_id"],
+            "incoming": msg["user_id"] != app.current_user_id,
+            "pending": False,
+        }
+
+    def add_incoming(self, msg):
+        # сообщение пришло по websocket
+        if msg.get("chat_id") != self.chat_id or msg["id"] in self._message_ids:
+            return
+        if msg.get("client_id") in self._pending:
+            # своё сообщение из outbox: websocket опередил ответ на отправку
+            self.confirm_sent(msg["client_id"], msg["id"])
+            return
+
+        app = MDApp.get_running_app()
+        if app is None:
+            return
+        app = cast(RippleChatApp, app)
+
+        if self._loading:
+            # идёт загрузка страницы — сообщение заберёт догрузка после неё
+            self._reload = True
+            return
 
-        self.update_chat()
+        self._remember(msg)
+        self._show([self._to_view(msg, app)])
+        self.mark_read()
+
+    def mark_read(self):
+        # двигаем курсор прочтения, только пока чат открыт на экране
+        app = MDApp.get_running_app()
+        if app is None or self.chat_id is None or self._last_id is None:
+            return
+        app = cast(RippleChatApp, app)
+        if app.sm.current != "chat" or self._last_id <= self._read_id:
+            return
+
+        message_id = self._last_id
+
+        def on_read(data):
+            self._read_id = max(self._read_id, message_id)
+
+        app.api.mark_read(
+            self.chat_id,
+            message_id,
+            group=self._requests,
+            on_success=on_read,
+            on_error=lambda e: print("Ошибка отметки прочтения:", e),
+        )
 
     def send_message(self, *args):
         text = self.text_input.text.strip()
@@ -591,84 +1039,136 @@ class RippleChatScreen(MDScreen): #Чат
             print("Нет запущенного приложения MDApp")
             return
         app = cast(RippleChatApp, app)
+        if app.cache is None:
+            return
 
-        headers = {"Authorization": f"Bearer {app.api_token}"}
-        payload = {
-            "user_id": app.current_user_id,
+        # сообщение сначала ложится в outbox на диске и сразу видно в ленте;
+        # до сервера его доносит RippleChatApp.flush_outbox, в том числе
+        # после обрыва сети или перезапуска. По client_id сервер узнаёт повтор
+        client_id = uuid.uuid4().hex
+        app.cache.enqueue(client_id, self.chat_id, text)
+        self.text_input.text = ""
+        self._show([self._pending_view(app, client_id, text)])
+        app.flush_outbox()
+
+    def _pending_view(self, app, client_id, text):
+        view = {
+            "message_id": 0,
             "text": text,
+            "user": app.current_username,
+            "user_id": app.current_user_id,
+            "incoming": False,
+            "pending": True,
         }
+        self._pending[client_id] = view
+        return view
+
+    def confirm_sent(self, client_id, message_id):
+        # сервер принял сообщение из outbox: строка остаётся на месте,
+        # получает id и перестаёт быть серой
+        view = self._pending.pop(client_id, None)
+        if view is None:
+            return
+        self._message_ids.add(message_id)
+        view["message_id"] = message_id
+        view["pending"] = False
+        self.scroll.refresh_from_data()
+
+    def drop_pending(self, client_ids):
+        # сервер отказался принимать (например, нас удалили из чата)
+        views = [self._pending.pop(cid) for cid in client_ids if cid in self._pending]
+        if views:
+            self.scroll.data = [row for row in self.scroll.data if not any(row is v for v in views)]
+
+    def refresh_user_names(self):
+        # пришли имена с сервера — подставляем их в уже показанные строки
+        app = MDApp.get_running_app()
+        if app is None:
+            return
+        app = cast(RippleChatApp, app)
+        changed = False
+        for view in self.scroll.data:
+            name = app.user_names.get(view["user_id"])
+            if name and view["user"] != name:
+                view["user"] = name
+                changed = True
+        if changed:
+            self.scroll.refresh_from_data()
+
+    def _show(self, views):
+        # только дописываем в конец: старые строки не пересоздаются,
+        # раскладка пересчитывается лишь для добавленных
+        if not views:
+            return
+        data = self.scroll.data
+        first = not data
+        at_bottom = self.scroll.scroll_y <= 0.01
+        data.extend(views)
+        if (first or at_bottom) and len(data) > MESSAGE_WINDOW:
+            # внизу чата старые строки не видны — отрезаем их сверху,
+            # вернуться к ним можно прокруткой вверх
+            del data[: len(data) - MESSAGE_WINDOW]
+            self._older_done = False
+        if first:
+            # открыли чат — показываем последние сообщения
+            Clock.schedule_once(lambda dt: setattr(self.scroll, "scroll_y", 0))
+
+    def _on_scroll(self, instance, scroll_y):
+        if scroll_y >= 0.99 and self.scroll.data and not self._older_done:
+            self.load_older()
+
+    def load_older(self):
+        # догружаем страницу сообщений старше первой строки ленты
+        if self._loading_older or self.chat_id is None:
+            return
+        app = MDApp.get_running_app()
+        if app is None:
+            return
+        app = cast(RippleChatApp, app)
 
-        try:
-            resp = requests.post(
-                f"{API_BASE_URL}/chats/{self.chat_id}/messages",
-                json=payload,
-                headers=headers,
-                timeout=5,
-            )
-            resp.raise_for_status()
-            data = resp.json()
-        except Exception as e:
-            print("Ошибка отправки сообщения:", e)
-            return
-
-        self.messages.append(
-            {
-                "text": data["text"],
-                "user": app.current_username,
-                "incoming": False,
-            }
+        before_id = self.scroll.data[0]["message_id"]
+        if app.cache is not None:
+            cached = app.cache.messages_before(self.chat_id, before_id, HISTORY_PAGE)
+            if cached:
+                self._prepend(app, cached)
+                return
+
+        def on_error(e):
+            print("Ошибка загрузки истории:", e)
+            self._loading_older = False
+
+        self._loading_older = True
+        app.api.get_messages(
+            self.chat_id,
+            before_id=before_id,
+            limit=HISTORY_PAGE,
+            group=self._requests,
+            on_success=lambda data: self._on_older(app, data),
+            on_error=on_error,
         )
-        self.text_input.text = ""
-        self.update_chat()
-
-    def update_chat(self):
-        self.chat_list.clear_widgets()
-
-        for msg in self.messages:
-            text = msg["text"]
-            user = msg["user"]
-            incoming = msg.get("incoming", True)
-
-            row = MDBoxLayout(
-                orientation="horizontal",
-                padding=(dp(8), dp(4)),
-                size_hint_y=None,
-            )
-            row.bind(minimum_height=row.setter("height"))
-
-            bubble = MDBoxLayout(
-                orientation="vertical",
-                padding=(dp(10), dp(6)),
-                size_hint_x=0.8,
-                md_bg_color=(1, 1, 1, 1) if incoming else (0.882, 0.996, 0.776, 1),
-                radius=[dp(16), dp(16), dp(16), dp(16)],
-                size_hint_y=None,
-            )
-            bubble.bind(minimum_height=bubble.setter("height"))
 
-            label = MDLabel(
-                text=f"{user}: {text}",
-                theme_text_color="Custom",
-                text_color=(0, 0, 0, 1),
-                halign="left",
-                valign="middle",
-                size_hint_y=None,
-            )
-            label.bind(width=lambda inst, val: setattr(inst, "text_size", (val, None)))
-            label.bind(
-                texture_size=lambda inst, val: setattr(inst, "height", val[1])
-            )
+    def _on_older(self, app, data):
+        self._loading_older = False
+        if data.get("next_cursor") is None:
+            self._older_done = True
+        if not data["items"]:
+            return
+        if app.cache is not None:
+            app.cache.save_messages(self.chat_id, data["items"])
+        self._prepend(app, data["items"])
 
-            bubble.add_widget(label)
+    def _prepend(self, app, items):
+        # вставка в начало пересчитывает всю ленту; держим на экране
+        # ту же строку, что была верхней до догрузки
+        old_height = self.message_layout.height
+        self.scroll.data = [self._to_view(msg, app) for msg in items] + list(self.scroll.data)
 
-            if incoming:
-                row.add_widget(bubble)
-                row.add_widget(MDBoxLayout(size_hint_x=0.2))
-            else:
-                row.add_widget(MDBoxLayout(size_hint_x=0.2))
-                row.add_widget(bubble)
+        def keep_position(dt):
+            scrollable = self.message_layout.height - self.scroll.height
+            if scrollable > 0:
+                self.scroll.scroll_y = min(1, (old_height - self.scroll.height) / scrollable)
 
-            self.chat_list.add_widget(row)
+        Clock.schedule_once(keep_position)
 
 
 class ChatMembersScreen(MDScreen): #Участники чата
@@ -678,6 +1178,7 @@ class ChatMembersScreen(MDScreen): #Участники чата
         self.chat_id: int | None = None
         self._remove_dialog = None
         self._user_to_remove: int | None = None
+        self._requests = RequestGroup()
 
         root = MDBoxLayout(orientation="vertical")
 
@@ -698,8 +1199,11 @@ class ChatMembersScreen(MDScreen): #Участники чата
         self.add_widget(root)
 
     def set_chat(self, chat_id: int, chat_title: str):
+        # список прошлого чата не должен приехать поверх нового
+        self._requests.cancel()
         self.chat_id = chat_id
         self.top_bar.title = f"Участники · {chat_title}"
+        self.members_list.clear_widgets()
         self.load_members()
 
     def go_back(self):
@@ -718,20 +1222,22 @@ class ChatMembersScreen(MDScreen): #Участники чата
             return
         app = cast(RippleChatApp, app)
 
-        headers = {"Authorization": f"Bearer {app.api_token}"}
+        if not self.members_list.children and app.cache is not None:
+            self._show_members(app.cache.members(self.chat_id))
 
-        try:
-            resp = requests.get(
-                f"{API_BASE_URL}/chats/{self.chat_id}/members",
-                headers=headers,
-                timeout=5,
-            )
-            resp.raise_for_status()
-            members = resp.json()
-        except Exception as e:
-            print("Ошибка загрузки участников чата:", e)
-            return
+        def on_members(members):
+            if app.cache is not None:
+                app.cache.save_members(self.chat_id, members)
+            self._show_members(members)
+
+        app.api.get_members(
+            self.chat_id,
+            group=self._requests,
+            on_success=on_members,
+            on_error=lambda e: print("Ошибка загрузки участников чата:", e),
+        )
 
+    def _show_members(self, members):
         self.members_list.clear_widgets()
         for m in members:
             user_id = m["user_id"]
@@ -786,27 +1292,26 @@ class ChatMembersScreen(MDScreen): #Участники чата
             return
         app = cast(RippleChatApp, app)
 
-        headers = {"Authorization": f"Bearer {app.api_token}"}
+        if self._remove_dialog:
+            self._remove_dialog.dismiss()
 
-        try:
-            resp = requests.delete(
-                f"{API_BASE_URL}/chats/{self.chat_id}/members/{self._user_to_remove}",
-                headers=headers,
-                timeout=5,
-            )
-            print("REMOVE MEMBER status:", resp.status_code, resp.text)
-            resp.raise_for_status()
-        except Exception as e:
-            print("Ошибка удаления участника:", e)
-        else:
+        def on_removed(data):
             # просто дергаем уже существующий экран со списком чатов
             app.chat_list_screen.load_chats()
-        finally:
-            if self._remove_dialog:
-                self._remove_dialog.dismiss()
+            # обновляем список участников текущего чата
+            self.load_members()
 
-        # обновляем список участников текущего чата
-        self.load_members()
+        def on_error(e):
+            print("Ошибка удаления участника:", e)
+            self.load_members()
+
+        app.api.remove_member(
+            self.chat_id,
+            self._user_to_remove,
+            group=self._requests,
+            on_success=on_removed,
+            on_error=on_error,
+        )
 
 class ProfileScreen(MDScreen):  # Профиль
     def __init__(self, **kwargs):
@@ -917,21 +1422,14 @@ class ProfileScreen(MDScreen):  # Профиль
             return
 
 
-        headers = {"Authorization": f"Bearer {app.api_token}"}
-        try:
-            resp = requests.get(
-                f"{API_BASE_URL}/users/{app.current_user_id}",
-                headers=headers,
-                timeout=5,
-            )
-            resp.raise_for_status()
-            data = resp.json()
-        except Exception as e:
-            print("Ошибка загрузки профиля:", e)
-            return
-
+        def on_profile(data):
+            self.nickname_field.text = data.get("display_name") or app.current_username or ""
 
-        self.nickname_field.text = data.get("display_name") or app.current_username or ""
+        app.api.get_user(
+            app.current_user_id,
+            on_success=on_profile,
+            on_error=lambda e: print("Ошибка загрузки профиля:", e),
+        )
 
 
 
@@ -960,37 +1458,44 @@ class ProfileScreen(MDScreen):  # Профиль
             return
 
 
-        headers = {"Authorization": f"Bearer {app.api_token}"}
-        try:
-            resp = requests.put(
-                f"{API_BASE_URL}/users/{app.current_user_id}",
-                json=payload,
-                headers=headers,
-                timeout=5,
-            )
-            print("PROFILE UPDATE status:", resp.status_code, resp.text)
-            resp.raise_for_status()
-        except Exception as e:
-            print("Ошибка сохранения профиля:", e)
-            return
-        
-        # если ник сменился — обновим локально
-        if "display_name" in payload:
-            app.current_username = payload["display_name"]
+        def on_saved(data):
+            # если ник сменился — обновим локально
+            if "display_name" in payload:
+                app.current_username = payload["display_name"]
+                app.user_names[app.current_user_id] = payload["display_name"]
 
+            # выключаем редактирование и очищаем поле пароля
+            self.password_field.text = ""
+            self.toggle_edit_mode(False)
 
-        # выключаем редактирование и очищаем поле пароля
-        self.password_field.text = ""
-        self.toggle_edit_mode(False)
+        app.api.update_user(
+            app.current_user_id,
+            payload,
+            on_success=on_saved,
+            on_error=lambda e: print("Ошибка сохранения профиля:", e),
+        )
 
 
 class RippleChatApp(MDApp): #приложение
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.sm = ScreenManager(transition=NoTransition())
-        self.api_token: str | None = None
+        self.api = ApiClient(API_BASE_URL)
+        self.cache: LocalCache | None = None
         self.current_user_id: int | None = None
         self.current_username: str | None = None
+        self.message_stream: MessageStream | None = None
+        self._outbox_requests = RequestGroup()
+        self._flushing = False
+        self._flush_event = None
+        self._flush_delay = OUTBOX_RETRY_MIN
+        # имена отправителей: id -> ник из кэша и /users/profiles. Каждое
+        # имя сверяем с сервером раз за сессию — ник могли сменить
+        self.user_names: dict[int, str] = {}
+        self._fresh_names: set[int] = set()
+        self._unresolved: set[int] = set()
+        self._resolve_event = None
+        self._profile_requests = RequestGroup()
         self.chat_list_screen: ChatListScreen
         self.chat_screen: RippleChatScreen
         self.chat_members_screen: ChatMembersScreen
@@ -1015,12 +1520,189 @@ class RippleChatApp(MDApp): #приложение
         self.sm.current = "login"
         return self.sm
 
+    @property
+    def api_token(self) -> str | None:
+        # токен живёт в ApiClient: он подставляет его в каждый запрос
+        return self.api.token
+
+    @api_token.setter
+    def api_token(self, value: str | None):
+        self.api.token = value
+
+    def on_stop(self):
+        self.stop_message_stream()
+        self.close_cache()
+        self.api.close()
+
+    def open_cache(self):
+        # у каждого пользователя на устройстве — своя база
+        self.close_cache()
+        path = os.path.join(self.user_data_dir, f"cache_{self.current_user_id}.db")
+        self.cache = LocalCache(path)
+        self.user_names = self.cache.display_names()
+        self._fresh_names = set()
+
+    def close_cache(self):
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+
+    def display_name(self, user_id: int) -> str:
+        # имя для строки ленты сразу из того, что знаем; незнакомых и ещё
+        # не сверенных собираем и спрашиваем у сервера одним запросом
+        if user_id not in self._fresh_names and user_id not in self._unresolved:
+            self._unresolved.add(user_id)
+            if self._resolve_event is None:
+                self._resolve_event = Clock.schedule_once(self._resolve_names)
+        return self.user_names.get(user_id) or f"User {user_id}"
+
+    def _resolve_names(self, *args):
+        self._resolve_event = None
+        ids = sorted(self._unresolved)
+        self._unresolved.clear()
+        self._fresh_names.update(ids)
+        for start in range(0, len(ids), PROFILES_BATCH):
+            chunk = ids[start:start + PROFILES_BATCH]
+
+            def on_error(e, chunk=chunk):
+                # спросим ещё раз, когда эти id снова попадут в ленту
+                self._fresh_names.difference_update(chunk)
+                print("Ошибка загрузки имён:", e)
+
+            self.api.get_profiles(
+                chunk,
+                group=self._profile_requests,
+                on_success=self._on_profiles,
+                on_error=on_error,
+            )
+
+    def _on_profiles(self, profiles):
+        if not profiles:
+            return
+        for profile in profiles:
+            self.user_names[profile["id"]] = profile["display_name"]
+        if self.cache is not None:
+            self.cache.save_profiles(profiles)
+        self.chat_screen.refresh_user_names()
+
     def open_chat(self, chat_id, chat_title):
-        self.chat_screen.set_chat(chat_id, chat_title)
         self.sm.current = "chat"
+        self.chat_screen.set_chat(chat_id, chat_title)
+
+    def start_message_stream(self):
+        self.stop_message_stream()
+        if not self.api_token:
+            return
+        self.message_stream = MessageStream(
+            self.api_token,
+            on_message=self.on_stream_message,
+            on_state=self.on_stream_state,
+        )
+        # пока websocket не подтвердил подключение, сообщения забирает long-poll
+        self.chat_screen.set_live(False)
+        self.message_stream.start()
+
+    def on_stream_state(self, live: bool):
+        self.chat_screen.set_live(live)
+        if live:
+            # связь вернулась — не ждём таймера повтора
+            self.flush_outbox()
+
+    def flush_outbox(self, *args):
+        # отправляет outbox пачками через /messages/bulk; пока пачка в пути,
+        # новая не уходит — порядок сообщений в чате сохраняется
+        if self.cache is None or self._flushing:
+            return
+        if self._flush_event is not None:
+            self._flush_event.cancel()
+            self._flush_event = None
+        batch = self.cache.outbox(limit=OUTBOX_BATCH)
+        if not batch:
+            return
+        # в пачке один чат: отказ по одному чату не задерживает остальные
+        batch = [item for item in batch if item["chat_id"] == batch[0]["chat_id"]]
+        client_ids = [item["client_id"] for item in batch]
+
+        def on_sent(data):
+            self._flushing = False
+            self._flush_delay = OUTBOX_RETRY_MIN
+            self.cache.drop_outbox(client_ids)
+            for client_id, message_id in zip(client_ids, data["ids"]):
+                self.chat_screen.confirm_sent(client_id, message_id)
+            Clock.schedule_once(self.flush_outbox)
+
+        def on_error(e):
+            self._flushing = False
+            status = getattr(getattr(e, "response", None), "status_code", None)
+            if status in (403, 422):
+                # такие сообщения сервер не примет никогда
+                print("Сообщения отклонены сервером:", e)
+                self.cache.drop_outbox(client_ids)
+                self.chat_screen.drop_pending(client_ids)
+                Clock.schedule_once(self.flush_outbox)
+            elif status == 401:
+                # сессия кончилась — outbox дождётся следующего входа
+                print("Ошибка отправки outbox:", e)
+            else:
+                # сети нет или сервер недоступен — повторим позже; повтор
+                # безопасен, дубликат сервер узнает по client_id
+                print(f"Ошибка отправки outbox, повтор через {self._flush_delay} с:", e)
+                self._flush_event = Clock.schedule_once(self.flush_outbox, self._flush_delay)
+                self._flush_delay = min(self._flush_delay * 2, OUTBOX_RETRY_MAX)
+
+        self._flushing = True
+        self.api.send_messages_bulk(
+            [
+                {
+                    "chat_id": item["chat_id"],
+                    "user_id": self.current_user_id,
+                    "text": item["text"],
+                    "client_id": item["client_id"],
+                }
+                for item in batch
+            ],
+            group=self._outbox_requests,
+            on_success=on_sent,
+            on_error=on_error,
+        )
+
+    def on_stream_message(self, msg):
+        self.chat_screen.add_incoming(msg)
+        # на экране списка чатов обновляем превью и счётчики
+        if self.sm.current == "chat_list":
+            self.chat_list_screen.load_chats()
+
+    def stop_message_stream(self):
+        if self.message_stream is not None:
+            self.message_stream.stop()
+            self.message_stream = None
+        self.chat_screen.stop_polling()
 
     def logout(self):
         print("== logout")
+        self.stop_message_stream()
+        # ответы, пришедшие после выхода, показывать уже некому
+        self.chat_list_screen._requests.cancel()
+        self.chat_screen.set_chat(None, "Чат")
+        self.chat_members_screen._requests.cancel()
+        # неотправленное остаётся в outbox и уйдёт после следующего входа
+        self._outbox_requests.cancel()
+        self._flushing = False
+        if self._flush_event is not None:
+            self._flush_event.cancel()
+            self._flush_event = None
+        self._flush_delay = OUTBOX_RETRY_MIN
+        self._profile_requests.cancel()
+        if self._resolve_event is not None:
+            self._resolve_event.cancel()
+            self._resolve_event = None
+        self._unresolved.clear()
+        self._fresh_names.clear()
+        self.user_names = {}
+        if self.api_token:
+            # гасим сессию на сервере, ошибку сети просто игнорируем
+            self.api.logout(on_error=lambda e: print("Ошибка выхода:", e))
+        self.close_cache()
         self.api_token = None
         self.current_user_id = None
         self.current_username = None
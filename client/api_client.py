@@ -0,0 +1,249 @@
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from kivy.clock import Clock
+
+
+HTTP_WORKERS = 4  # сколько запросов к API идёт параллельно
+DEFAULT_TIMEOUT = 5
+ETAG_CACHE_SIZE = 64  # сколько последних GET-ответов с ETag помним для 304
+# Повторяем только то, что безопасно отправить дважды: обрыв соединения до
+# отправки запроса — для любого метода, 502/503/504 и обрыв чтения — лишь для
+# идемпотентных методов. POST (отправка сообщения) не повторяем.
+RETRY = Retry(
+    total=3,
+    backoff_factor=0.3,  # 0.3 с, 0.6 с, 1.2 с
+    status_forcelist=(502, 503, 504),
+    allowed_methods=frozenset({"GET", "HEAD", "PUT", "DELETE", "OPTIONS"}),
+    raise_on_status=False,
+)
+
+OnSuccess = Callable[[Any], None]
+OnError = Callable[[Exception], None]
+
+
+class RequestGroup: # запросы одного экрана, которые отменяются разом
+    def __init__(self):
+        self.generation = 0
+        self.futures: set[Future] = set()
+
+    def cancel(self):
+        # ещё не начатые запросы не уйдут вовсе, ответы уже ушедших
+        # отбросит ApiClient: их поколение устарело
+        self.generation += 1
+        for future in self.futures:
+            future.cancel()
+        self.futures.clear()
+
+
+class ApiClient: # клиент RippleChat API: одна keep-alive сессия на всё приложение
+    def __init__(self, base_url: str, workers: int = HTTP_WORKERS):
+        self.base_url = base_url
+        self.token: str | None = None
+        self.session = requests.Session()
+        # соединений в пуле — по одному на поток пула и на long-poll;
+        # gzip и br (если есть пакет brotli) requests запрашивает и распаковывает сам
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers + 1, max_retries=RETRY)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="http")
+        # url -> (ETag, тело): повторный GET отправляем с If-None-Match, и на 304
+        # разбираем сохранённое тело. Храним байты, а не JSON — каждый
+        # получатель получает свою копию данных
+        self._etags: OrderedDict[str, tuple[str, bytes]] = OrderedDict()
+        self._etags_lock = threading.Lock()
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+    def auth_headers(self) -> dict[str, str]:
+        return {"Authorization": f"Bearer {self.token}"} if self.token else {}
+
+    def call(self, method: str, path: str, timeout: float = DEFAULT_TIMEOUT, **kwargs) -> Any:
+        # синхронный запрос — для фоновых потоков (пул, long-poll);
+        # возвращает разобранный JSON, None, если тела нет
+        kwargs.setdefault("headers", self.auth_headers())
+        url = f"{self.base_url}{path}"
+        if method != "GET":
+            resp = self.session.request(method, url, timeout=timeout, **kwargs)
+            resp.raise_for_status()
+            return resp.json() if resp.content else None
+
+        key = requests.Request("GET", url, params=kwargs.get("params")).prepare().url
+        with self._etags_lock:
+            cached = self._etags.get(key)
+        if cached is not None:
+            kwargs["headers"] = {**kwargs["headers"], "If-None-Match": cached[0]}
+        resp = self.session.request(method, url, timeout=timeout, **kwargs)
+        if resp.status_code == 304 and cached is not None:
+            body = cached[1]
+        else:
+            resp.raise_for_status()
+            body = resp.content
+        etag = resp.headers.get("ETag")
+        with self._etags_lock:
+            if etag:
+                self._etags[key] = (etag, body)
+                self._etags.move_to_end(key)
+                while len(self._etags) > ETAG_CACHE_SIZE:
+                    self._etags.popitem(last=False)
+            else:
+                self._etags.pop(key, None)
+        return json.loads(body) if body else None
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        on_success: OnSuccess | None = None,
+        on_error: OnError | None = None,
+        group: RequestGroup | None = None,
+        **kwargs,
+    ) -> Future:
+        # запрос в пуле потоков; on_success получает JSON, on_error — исключение,
+        # оба вызываются через Clock в UI-потоке. Токен берём сейчас, а не
+        # в потоке пула: после logout запрос уйдёт с тем, с чем был создан
+        kwargs.setdefault("headers", self.auth_headers())
+        generation = group.generation if group is not None else None
+        future = self._pool.submit(self.call, method, path, **kwargs)
+        if group is not None:
+            group.futures.add(future)
+
+        def deliver(dt):
+            if group is not None:
+                group.futures.discard(future)
+                if group.generation != generation:
+                    return
+            error = future.exception()
+            if error is not None:
+                if on_error is not None:
+                    on_error(error)
+                else:
+                    print(f"Ошибка запроса {method} {path}:", error)
+            elif on_success is not None:
+                on_success(future.result())
+
+        # колбэк future приходит из потока пула — в UI переходим через Clock
+        future.add_done_callback(
+            lambda f: None if f.cancelled() else Clock.schedule_once(deliver)
+        )
+        return future
+
+    # ---- вход ----
+
+    def login(self, username: str, password: str, **callbacks) -> Future:
+        return self.request(
+            "POST", "/login", data={"username": username, "password": password}, **callbacks
+        )
+
+    def logout(self, **callbacks) -> Future:
+        with self._etags_lock:
+            self._etags.clear()
+        return self.request("POST", "/logout", **callbacks)
+
+    # ---- пользователи ----
+
+    def search_users(
+        self, q: str, exclude_chat_id: int | None = None, cursor: int = 0, **callbacks
+    ) -> Future:
+        params = {"q": q, "cursor": cursor}
+        if exclude_chat_id is not None:
+            params["exclude_chat_id"] = exclude_chat_id
+        return self.request("GET", "/users/search", params=params, **callbacks)
+
+    def get_user(self, user_id: int, **callbacks) -> Future:
+        return self.request("GET", f"/users/{user_id}", **callbacks)
+
+    def get_profiles(self, ids: list[int], **callbacks) -> Future:
+        # имена нескольких пользователей одним запросом (не больше 200 id)
+        params = {"ids": ",".join(map(str, ids))}
+        return self.request("GET", "/users/profiles", params=params, **callbacks)
+
+    def update_user(self, user_id: int, payload: dict, **callbacks) -> Future:
+        return self.request("PUT", f"/users/{user_id}", json=payload, **callbacks)
+
+    # ---- чаты ----
+
+    def get_chat_summaries(self, user_id: int, **callbacks) -> Future:
+        return self.request("GET", f"/users/{user_id}/chats/summary", **callbacks)
+
+    def create_chat(self, title: str, creator_id: int, **callbacks) -> Future:
+        return self.request(
+            "POST", "/chats", json={"title": title, "creator_id": creator_id}, **callbacks
+        )
+
+    def get_members(self, chat_id: int, **callbacks) -> Future:
+        return self.request("GET", f"/chats/{chat_id}/members", **callbacks)
+
+    def add_member(self, chat_id: int, user_id: int, **callbacks) -> Future:
+        return self.request(
+            "POST", f"/chats/{chat_id}/members", json={"user_id": user_id}, **callbacks
+        )
+
+    def remove_member(self, chat_id: int, user_id: int, **callbacks) -> Future:
+        return self.request("DELETE", f"/chats/{chat_id}/members/{user_id}", **callbacks)
+
+    # ---- сообщения ----
+
+    def get_messages(
+        self,
+        chat_id: int,
+        after_id: int | None = None,
+        before_id: int | None = None,
+        limit: int | None = None,
+        **callbacks,
+    ) -> Future:
+        params = {}
+        if limit is not None:
+            params["limit"] = limit
+        if after_id is not None:
+            params["after_id"] = after_id
+        if before_id is not None:
+            params["before_id"] = before_id
+        return self.request("GET", f"/chats/{chat_id}/messages", params=params, **callbacks)
+
+    def send_message(
+        self, chat_id: int, user_id: int, text: str, client_id: str | None = None, **callbacks
+    ) -> Future:
+        return self.request(
+            "POST",
+            f"/chats/{chat_id}/messages",
+            json={"user_id": user_id, "text": text, "client_id": client_id},
+            **callbacks,
+        )
+
+    def send_messages_bulk(self, items: list[dict], **callbacks) -> Future:
+        # items: chat_id, user_id, text, client_id; в ответе ids в том же порядке.
+        # POST не повторяется сессией сам, но с client_id его можно слать заново
+        return self.request("POST", "/messages/bulk", json=items, **callbacks)
+
+    def mark_read(self, chat_id: int, message_id: int, **callbacks) -> Future:
+        return self.request(
+            "POST", f"/chats/{chat_id}/read", json={"message_id": message_id}, **callbacks
+        )
+
+    def search_messages(self, q: str, chat_id: int, cursor: int = 0, **callbacks) -> Future:
+        return self.request(
+            "GET",
+            "/search/messages",
+            params={"q": q, "chat_id": chat_id, "cursor": cursor},
+            **callbacks,
+        )
+
+    def poll_messages(self, token: str, chat_id: int, after_id: int, wait: int) -> list[dict]:
+        # long-poll: блокирующий вызов для потока LongPoller
+        data = self.call(
+            "GET",
+            f"/chats/{chat_id}/messages",
+            params={"after_id": after_id, "wait": wait},
+            headers={"Authorization": f"Bearer {token}"},
+            timeout=wait + 10,
+        )
+        return data["items"]
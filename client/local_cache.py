@@ -0,0 +1,212 @@
+import json
+import sqlite3
+
+
+# Сколько последних сообщений чата храним на устройстве: больше — догрузка
+# с сервера прокруткой вверх, как раньше.
+CACHE_MESSAGES_PER_CHAT = 2000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chats (
+    id INTEGER PRIMARY KEY,
+    position INTEGER NOT NULL,
+    summary TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_messages_chat_id ON messages (chat_id, id);
+CREATE TABLE IF NOT EXISTS sync (
+    chat_id INTEGER PRIMARY KEY,
+    synced_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS outbox (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    client_id TEXT NOT NULL UNIQUE,
+    chat_id INTEGER NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    display_name TEXT
+);
+CREATE TABLE IF NOT EXISTS members (
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    PRIMARY KEY (chat_id, user_id)
+);
+"""
+
+MESSAGE_COLUMNS = ("id", "chat_id", "user_id", "text", "created_at")
+
+
+class LocalCache: # копия данных пользователя на устройстве, ключи — id сервера
+    # Сообщения чата в кэше — непрерывный отрезок истории до synced_id:
+    # последняя страница, затем дельты after_id и страницы before_id от его
+    # краёв. Сообщения не редактируются и не удаляются, так что отрезок
+    # не устаревает, а при открытии чата с сервера нужна только дельта после
+    # synced_id. Пришедшее по websocket в кэш не пишем: пропуск в середине
+    # отрезка потом уже не заметить.
+    # Работает только из UI-потока: запросы идут по индексу и занимают
+    # доли миллисекунды.
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        # кэш, созданный до появления ников, дополняем колонкой
+        columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(users)")}
+        if "display_name" not in columns:
+            self.conn.execute("ALTER TABLE users ADD COLUMN display_name TEXT")
+
+    def close(self):
+        self.conn.close()
+
+    # ---- чаты ----
+
+    def chats(self) -> list[dict]:
+        rows = self.conn.execute("SELECT summary FROM chats ORDER BY position")
+        return [json.loads(row["summary"]) for row in rows]
+
+    def save_chats(self, summaries: list[dict]):
+        # список с сервера полный: чаты, которых в нём нет, пользователь покинул
+        ids = [chat["id"] for chat in summaries]
+        marks = ",".join("?" * len(ids))
+        with self.conn:
+            self.conn.execute("DELETE FROM chats")
+            self.conn.executemany(
+                "INSERT INTO chats (id, position, summary) VALUES (?, ?, ?)",
+                [(chat["id"], pos, json.dumps(chat)) for pos, chat in enumerate(summaries)],
+            )
+            self.conn.execute(f"DELETE FROM messages WHERE chat_id NOT IN ({marks})", ids)
+            self.conn.execute(f"DELETE FROM members WHERE chat_id NOT IN ({marks})", ids)
+            self.conn.execute(f"DELETE FROM sync WHERE chat_id NOT IN ({marks})", ids)
+            # outbox не чистим: неотправленное в покинутый чат отклонит сервер (403)
+
+    # ---- сообщения ----
+
+    def synced_id(self, chat_id: int) -> int | None:
+        row = self.conn.execute(
+            "SELECT synced_id FROM sync WHERE chat_id = ?", (chat_id,)
+        ).fetchone()
+        return row["synced_id"] if row is not None else None
+
+    def last_messages(self, chat_id: int, limit: int) -> list[dict]:
+        # последние сообщения непрерывного отрезка
+        rows = self.conn.execute(
+            "SELECT * FROM messages WHERE chat_id = ? "
+            "AND id <= (SELECT synced_id FROM sync WHERE chat_id = ?) "
+            "ORDER BY id DESC LIMIT ?",
+            (chat_id, chat_id, limit),
+        ).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+    def messages_before(self, chat_id: int, before_id: int, limit: int) -> list[dict]:
+        rows = self.conn.execute(
+            "SELECT * FROM messages WHERE chat_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+            (chat_id, before_id, limit),
+        ).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+    def save_messages(self, chat_id: int, messages: list[dict], synced: bool = False):
+        # страница с сервера, примыкающая к отрезку; synced — она продолжает
+        # его вверх (последняя страница или дельта after_id от synced_id)
+        if not messages:
+            return
+        with self.conn:
+            if synced:
+                self.conn.execute(
+                    "INSERT INTO sync (chat_id, synced_id) VALUES (?, ?) "
+                    "ON CONFLICT (chat_id) DO UPDATE "
+                    "SET synced_id = max(synced_id, excluded.synced_id)",
+                    (chat_id, max(msg["id"] for msg in messages)),
+                )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO messages (id, chat_id, user_id, text, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [tuple(msg[col] for col in MESSAGE_COLUMNS) for msg in messages],
+            )
+            # старые сообщения сверх лимита отрезаем — отрезок остаётся непрерывным
+            self.conn.execute(
+                "DELETE FROM messages WHERE chat_id = ? AND id < ("
+                " SELECT id FROM messages WHERE chat_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (chat_id, chat_id, CACHE_MESSAGES_PER_CHAT - 1),
+            )
+
+    # ---- исходящие ----
+
+    def enqueue(self, client_id: str, chat_id: int, text: str):
+        # сообщение считается отправленным для пользователя, как только
+        # оно здесь: переживает и обрыв сети, и перезапуск приложения
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO outbox (client_id, chat_id, text) VALUES (?, ?, ?)",
+                (client_id, chat_id, text),
+            )
+
+    def outbox(self, chat_id: int | None = None, limit: int = -1) -> list[dict]:
+        # в порядке отправки
+        if chat_id is None:
+            rows = self.conn.execute("SELECT * FROM outbox ORDER BY seq LIMIT ?", (limit,))
+        else:
+            rows = self.conn.execute(
+                "SELECT * FROM outbox WHERE chat_id = ? ORDER BY seq LIMIT ?", (chat_id, limit)
+            )
+        return [dict(row) for row in rows]
+
+    def drop_outbox(self, client_ids: list[str]):
+        with self.conn:
+            self.conn.executemany(
+                "DELETE FROM outbox WHERE client_id = ?", [(cid,) for cid in client_ids]
+            )
+
+    # ---- участники и пользователи ----
+
+    def members(self, chat_id: int) -> list[dict]:
+        rows = self.conn.execute(
+            "SELECT m.chat_id, m.user_id, u.name AS user_name FROM members m "
+            "JOIN users u ON u.id = m.user_id WHERE m.chat_id = ? ORDER BY m.user_id",
+            (chat_id,),
+        )
+        return [dict(row) for row in rows]
+
+    def save_members(self, chat_id: int, members: list[dict]):
+        with self.conn:
+            self._save_users([(m["user_id"], m["user_name"]) for m in members])
+            self.conn.execute("DELETE FROM members WHERE chat_id = ?", (chat_id,))
+            self.conn.executemany(
+                "INSERT INTO members (chat_id, user_id) VALUES (?, ?)",
+                [(chat_id, m["user_id"]) for m in members],
+            )
+
+    def save_users(self, users: list[dict]):
+        with self.conn:
+            self._save_users([(u["id"], u["name"]) for u in users])
+
+    def save_profiles(self, profiles: list[dict]):
+        # ответ /users/profiles: логин и ник
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO users (id, name, display_name) VALUES (?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE "
+                "SET name = excluded.name, display_name = excluded.display_name",
+                [(p["id"], p["name"], p["display_name"]) for p in profiles],
+            )
+
+    def display_names(self) -> dict[int, str]:
+        # id -> имя для ленты: ник, а пока его не узнали — логин
+        rows = self.conn.execute("SELECT id, coalesce(display_name, name) AS name FROM users")
+        return {row["id"]: row["name"] for row in rows}
+
+    def _save_users(self, rows: list[tuple]):
+        self.conn.executemany(
+            "INSERT INTO users (id, name) VALUES (?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET name = excluded.name",
+            rows,
+        )